@@ -0,0 +1,161 @@
+"""Benchmark harness for the plagiarism engines.
+
+Runs each engine configuration over a corpus made by corpus.py, each in a
+fresh subprocess so timings and peak RSS are not skewed by earlier runs,
+and records wall time, pairs per second, peak RSS and precision/recall of
+the planted clones. Results are printed as a table and appended as JSON
+lines to --output so regressions can be tracked over time.
+
+    python corpus.py /tmp/corpus --files 300
+    python bench.py /tmp/corpus --engines app-exhaustive,app-index --output bench.jsonl
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from itertools import combinations
+
+from corpus import load_ground_truth
+
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# name -> (service module, keyword arguments for its scoring entry point)
+ENGINES = {
+    'app-exhaustive': ('app', {'use_index': False, 'prefilter': False, 'workers': 1}),
+    'app-prefilter': ('app', {'use_index': False, 'workers': 1}),
+    'app-index': ('app', {'use_index': True, 'workers': 1}),
+    'app-parallel': ('app', {}),
+    'two-combined': ('two', {}),
+}
+DEFAULT_ENGINES = ['app-exhaustive', 'app-prefilter', 'app-index', 'app-parallel']
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _run_app(folder, threshold, options):
+    sys.path.insert(0, os.path.join(BACKEND_DIR, 'models'))
+    os.chdir(os.path.join(BACKEND_DIR, 'models'))
+    import app
+
+    start = time.perf_counter()
+    results = app.compare_all_submissions(folder, threshold=threshold, **options)
+    elapsed = time.perf_counter() - start
+    return elapsed, [(m['student_1'], m['student_2']) for m in results['matches']]
+
+
+def _run_two(folder, threshold, options):
+    # combined_similarity needs no model, so skip the warm-up load
+    os.environ['MODEL_WARMUP'] = '0'
+    sys.path.insert(0, os.path.join(BACKEND_DIR, 'two_code'))
+    os.chdir(os.path.join(BACKEND_DIR, 'two_code'))
+    import two
+
+    start = time.perf_counter()
+    files = sorted(os.listdir(folder))
+    codes = {}
+    for name in files:
+        with open(os.path.join(folder, name), 'r', encoding='utf-8') as f:
+            codes[name] = f.read()
+    detected = []
+    for f1, f2 in combinations(files, 2):
+        if two.combined_similarity(codes[f1], codes[f2], two.language_for(f1),
+                                   two.language_for(f2))['final_similarity'] >= threshold:
+            detected.append((f1, f2))
+    elapsed = time.perf_counter() - start
+    return elapsed, detected
+
+
+def run_engine(name, folder, threshold):
+    """Run one engine in this process and return its raw measurements."""
+    module, options = ENGINES[name]
+    runner = _run_app if module == 'app' else _run_two
+    elapsed, detected = runner(os.path.abspath(folder), threshold, options)
+    return {'seconds': elapsed, 'detected': detected, 'peak_rss_mb': _peak_rss_mb()}
+
+
+def measure(name, corpus_dir, threshold, truth):
+    folder = os.path.join(corpus_dir, 'submissions')
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), corpus_dir, '--child', name,
+         '--threshold', str(threshold)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        return {'engine': name, 'error': proc.stderr.strip().splitlines()[-1:]}
+
+    raw = json.loads(proc.stdout.strip().splitlines()[-1])
+    n_files = len(os.listdir(folder))
+    pairs = n_files * (n_files - 1) // 2
+    detected = {frozenset(pair) for pair in raw['detected']}
+    true_positives = len(detected & truth)
+    return {
+        'engine': name,
+        'options': ENGINES[name][1],
+        'files': n_files,
+        'pairs': pairs,
+        'seconds': round(raw['seconds'], 3),
+        'pairs_per_second': round(pairs / raw['seconds'], 1) if raw['seconds'] else None,
+        'peak_rss_mb': raw['peak_rss_mb'],
+        'detected': len(detected),
+        'precision': round(true_positives / len(detected), 4) if detected else None,
+        'recall': round(true_positives / len(truth), 4) if truth else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the plagiarism engines')
+    parser.add_argument('corpus_dir', help='directory written by corpus.py')
+    parser.add_argument('--engines', default=','.join(DEFAULT_ENGINES),
+                        help='comma-separated subset of: ' + ', '.join(ENGINES))
+    parser.add_argument('--threshold', type=float, default=50)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', help='append JSON lines results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        raw = run_engine(args.child, os.path.join(args.corpus_dir, 'submissions'),
+                         args.threshold)
+        print(json.dumps(raw))
+        return
+
+    truth = load_ground_truth(args.corpus_dir)
+    run_info = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'corpus': os.path.abspath(args.corpus_dir),
+        'threshold': args.threshold,
+    }
+    results = []
+    for name in args.engines.split(','):
+        for _ in range(args.repeat):
+            result = measure(name, args.corpus_dir, args.threshold, truth)
+            results.append({**run_info, **result})
+            if 'error' in result:
+                print(f"{name:16} failed: {result['error']}")
+            else:
+                print(f"{name:16} {result['seconds']:9.3f}s {result['pairs_per_second']:>11} pairs/s "
+                      f"{result['peak_rss_mb']} MB  P={result['precision']} R={result['recall']}")
+
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
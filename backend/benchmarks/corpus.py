@@ -0,0 +1,274 @@
+"""Synthetic submission corpora with planted clones.
+
+Generates a folder of student-style Python submissions where some files are
+disguised copies of others (renamed identifiers, reordered definitions,
+inserted dead code). Submissions go to out_dir/submissions and the clone
+families to out_dir/ground_truth.json, so detection precision and recall
+can be measured.
+
+    python corpus.py out_dir --files 300 --lines 120 --clone-ratio 0.3
+"""
+import argparse
+import ast
+import builtins
+import json
+import os
+import random
+from itertools import combinations
+
+
+SEED_DIR = os.path.join(os.path.dirname(__file__), '..', 'two_code')
+SEED_FILES = ['s1.py', 's3.py']
+TRANSFORMS = ('rename', 'reorder', 'deadcode')
+
+WORDS = [
+    'task', 'item', 'value', 'count', 'total', 'node', 'record', 'entry', 'score',
+    'name', 'index', 'result', 'buffer', 'queue', 'user', 'order', 'price', 'stock',
+    'grade', 'student', 'course', 'event', 'width', 'height', 'limit', 'step',
+]
+RESERVED = set(dir(builtins)) | {'self', 'cls'}
+
+
+def _ident(rng, used):
+    while True:
+        name = '_'.join(rng.sample(WORDS, rng.randint(1, 2)))
+        if rng.random() < 0.5:
+            name += str(rng.randint(0, 99))
+        if name not in used and name not in RESERVED:
+            used.add(name)
+            return name
+
+
+def _statement(rng, names, used, indent):
+    pad = '    ' * indent
+    a, b = rng.choice(names), rng.choice(names)
+    kind = rng.randrange(6)
+    if kind == 0:
+        target = _ident(rng, used)
+        names.append(target)
+        op = rng.choice('+-*')
+        return [f'{pad}{target} = {a} {op} {b} {op} {rng.randint(1, 9)}']
+    if kind == 1:
+        acc, var = _ident(rng, used), _ident(rng, used)
+        names.append(acc)
+        return [f'{pad}{acc} = 0',
+                f'{pad}for {var} in range({rng.randint(2, 20)}):',
+                f'{pad}    {acc} += {var} * {a}']
+    if kind == 2:
+        return [f'{pad}if {a} > {b}:',
+                f'{pad}    {a} = {a} - {b}',
+                f'{pad}else:',
+                f'{pad}    {b} = {b} + {rng.randint(1, 5)}']
+    if kind == 3:
+        target = _ident(rng, used)
+        names.append(target)
+        return [f'{pad}{target} = [{a} * k for k in range({rng.randint(3, 9)}) if k % 2]']
+    if kind == 4:
+        return [f'{pad}while {a} > {rng.randint(50, 500)}:',
+                f'{pad}    {a} //= 2']
+    return [f'{pad}print("{rng.choice(WORDS)}:", {a}, {b})']
+
+
+def _function(rng, used, lines, indent=0, method=False):
+    name = _ident(rng, used)
+    params = [_ident(rng, used) for _ in range(rng.randint(1, 3))]
+    pad = '    ' * indent
+    out = [f'{pad}def {name}({", ".join((["self"] if method else []) + params)}):']
+    names = list(params)
+    while len(out) < lines:
+        out.extend(_statement(rng, names, used, indent + 1))
+    out.append(f'{pad}    return {rng.choice(names)}')
+    return f'{name}({", ".join(str(rng.randint(1, 9)) for _ in params)})', out
+
+
+def random_program(rng, n_lines):
+    """A random, syntactically valid program of roughly n_lines lines."""
+    used = set()
+    out = ['import math', '']
+    functions = []
+    while len(out) < n_lines:
+        if rng.random() < 0.3:
+            cls = _ident(rng, used).title().replace('_', '')
+            out.append(f'class {cls}:')
+            for _ in range(rng.randint(1, 3)):
+                _, body = _function(rng, used, rng.randint(4, 12), indent=1, method=True)
+                out.extend(body)
+                out.append('')
+            out.append('')
+        else:
+            call, body = _function(rng, used, rng.randint(4, 16))
+            functions.append(call)
+            out.extend(body)
+            out.extend(['', ''])
+    calls = [f'    print({call})' for call in functions[:3]] or ['    pass']
+    out.extend(['def main():'] + calls + ['', '', 'if __name__ == "__main__":', '    main()', ''])
+    return '\n'.join(out)
+
+
+class _Renamer(ast.NodeTransformer):
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def _new(self, name):
+        return self.mapping.get(name, name)
+
+    def visit_Name(self, node):
+        node.id = self._new(node.id)
+        return node
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        node.attr = self._new(node.attr)
+        return node
+
+    def visit_arg(self, node):
+        node.arg = self._new(node.arg)
+        return node
+
+    def visit_FunctionDef(self, node):
+        self.generic_visit(node)
+        node.name = self._new(node.name)
+        return node
+
+    def visit_ClassDef(self, node):
+        self.generic_visit(node)
+        node.name = self._new(node.name)
+        return node
+
+
+def _defined_names(tree):
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+        elif isinstance(node, ast.Attribute) and isinstance(node.ctx, ast.Store):
+            names.add(node.attr)
+    return {n for n in names if n not in RESERVED and not n.startswith('__')}
+
+
+def rename_identifiers(tree, rng):
+    used = set()
+    mapping = {name: _ident(rng, used) + '_' + str(rng.randint(0, 9))
+               for name in sorted(_defined_names(tree))}
+    return _Renamer(mapping).visit(tree)
+
+
+def reorder_definitions(tree, rng):
+    head = [n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom))]
+    tail = [n for n in tree.body if isinstance(n, ast.If)]
+    defs = [n for n in tree.body if n not in head and n not in tail]
+    rng.shuffle(defs)
+    for node in defs:
+        if isinstance(node, ast.ClassDef):
+            rng.shuffle(node.body)
+    tree.body = head + defs + tail
+    return tree
+
+
+def insert_dead_code(tree, rng):
+    bodies = [n.body for n in ast.walk(tree) if isinstance(n, ast.FunctionDef)]
+    for body in rng.sample(bodies, max(1, len(bodies) // 2)) if bodies else []:
+        snippet = rng.choice([
+            f'_unused_{rng.randint(0, 999)} = {rng.randint(0, 99)}',
+            f'if False:\n    print("{rng.choice(WORDS)}")',
+            'for _ in range(0):\n    pass',
+        ])
+        body.insert(rng.randint(0, max(len(body) - 1, 0)), ast.parse(snippet).body[0])
+    return tree
+
+
+def make_clone(source, rng, transforms=TRANSFORMS):
+    """Apply a random non-empty subset of transforms to a Python source."""
+    chosen = [t for t in transforms if rng.random() < 0.6] or [rng.choice(transforms)]
+    tree = ast.parse(source)
+    if 'reorder' in chosen:
+        tree = reorder_definitions(tree, rng)
+    if 'deadcode' in chosen:
+        tree = insert_dead_code(tree, rng)
+    if 'rename' in chosen:
+        tree = rename_identifiers(tree, rng)
+    return ast.unparse(ast.fix_missing_locations(tree)) + '\n'
+
+
+def generate_corpus(out_dir, n_files=100, lines=80, clone_ratio=0.3, max_family=5,
+                    transforms=TRANSFORMS, seed=0, use_seeds=True):
+    """Write n_files submissions to out_dir and return the clone families.
+
+    About clone_ratio of the files are disguised copies of an original, in
+    families of up to max_family files. When use_seeds is set, s1.py and
+    s3.py (themselves a renamed pair) start the first family.
+    """
+    rng = random.Random(seed)
+    submissions_dir = os.path.join(out_dir, 'submissions')
+    os.makedirs(submissions_dir, exist_ok=True)
+    sources = []
+    families = []
+
+    if use_seeds:
+        family = []
+        for seed_file in SEED_FILES:
+            with open(os.path.join(SEED_DIR, seed_file), 'r', encoding='utf-8') as f:
+                family.append(len(sources))
+                sources.append(f.read())
+        families.append(family)
+
+    n_clones = int(n_files * clone_ratio)
+    n_originals = max(1, n_files - n_clones - len(sources))
+    for _ in range(n_originals):
+        size = max(10, int(rng.gauss(lines, lines / 4)))
+        families.append([len(sources)])
+        sources.append(random_program(rng, size))
+
+    while len(sources) < n_files:
+        family = rng.choice(families)
+        if len(family) >= max_family:
+            open_families = [f for f in families if len(f) < max_family]
+            if not open_families:
+                break
+            family = rng.choice(open_families)
+        family.append(len(sources))
+        sources.append(make_clone(sources[family[0]], rng, transforms))
+
+    names = []
+    for i, source in enumerate(sources):
+        name = f'student{i:04d}_{rng.randint(10000, 99999)}_solution.py'
+        names.append(name)
+        with open(os.path.join(submissions_dir, name), 'w', encoding='utf-8') as f:
+            f.write(source)
+
+    clone_families = [[names[i] for i in family] for family in families if len(family) > 1]
+    with open(os.path.join(out_dir, 'ground_truth.json'), 'w', encoding='utf-8') as f:
+        json.dump({'families': clone_families}, f, indent=2)
+    return clone_families
+
+
+def load_ground_truth(corpus_dir):
+    with open(os.path.join(corpus_dir, 'ground_truth.json'), 'r', encoding='utf-8') as f:
+        families = json.load(f)['families']
+    return {frozenset(pair) for family in families for pair in combinations(family, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic submission corpus')
+    parser.add_argument('out_dir')
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--lines', type=int, default=80, help='mean lines per original')
+    parser.add_argument('--clone-ratio', type=float, default=0.3)
+    parser.add_argument('--max-family', type=int, default=5)
+    parser.add_argument('--transforms', default=','.join(TRANSFORMS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-seeds', action='store_true', help='do not include s1.py/s3.py')
+    args = parser.parse_args()
+
+    families = generate_corpus(args.out_dir, args.files, args.lines, args.clone_ratio,
+                               args.max_family, tuple(args.transforms.split(',')),
+                               args.seed, not args.no_seeds)
+    print(f'Wrote {args.files} files with {len(families)} clone families to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Score drift and throughput of the detector's inference backends.
+
+Scores a sample of source files with the fp32 torch baseline and with each
+other backend (see INFERENCE_BACKENDS in two.py), all built from one loaded
+fp32 model so only the backend differs, then reports how far the
+AI probabilities move from the baseline, how often the verdict flips, and
+files/windows per second for every backend.
+
+    python detector_drift.py /tmp/corpus/submissions --backends torch-int8,onnx --limit 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SAMPLE_DIR = os.path.join(BACKEND_DIR, 'two_code')
+
+
+def load_sample(folder, limit):
+    two = _import_two()
+    codes = {}
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path) and two.allowed_file(name):
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                codes[name] = f.read()
+        if limit and len(codes) >= limit:
+            break
+    return codes
+
+
+def _import_two():
+    # The backends are built explicitly, so skip the service's warm-up load
+    os.environ['MODEL_WARMUP'] = '0'
+    sys.path.insert(0, os.path.join(BACKEND_DIR, 'two_code'))
+    import two
+    return two
+
+
+def score_backend(backend, codes, batch_size, base):
+    """Score codes with one backend built from base, a two.BaseModel, and
+    return (results, timings)."""
+    two = _import_two()
+    start = time.perf_counter()
+    tokenizer, pipe = two.build_detector(backend, base=base)
+    load_seconds = time.perf_counter() - start
+
+    names = list(codes)
+    start = time.perf_counter()
+    languages = [two.language_for(n) for n in names]
+    results = two.detect_ai_batch([codes[n] for n in names], batch_size=batch_size, pipe=pipe,
+                                  model_tokenizer=tokenizer, languages=languages)
+    seconds = time.perf_counter() - start
+    windows = sum(len(two.split_windows(two.preprocess_code(codes[n], language), tokenizer))
+                  for n, language in zip(names, languages))
+    return dict(zip(names, results)), {
+        'load_seconds': round(load_seconds, 2),
+        'seconds': round(seconds, 3),
+        'files_per_second': round(len(names) / seconds, 2) if seconds else None,
+        'windows_per_second': round(windows / seconds, 2) if seconds else None,
+    }
+
+
+def drift(baseline, results):
+    """Mean/max absolute AI-probability drift and verdict agreement."""
+    deltas = []
+    agree = 0
+    for name, base in baseline.items():
+        other = results.get(name, {})
+        if 'ai_prob' not in base or 'ai_prob' not in other:
+            continue
+        deltas.append(abs(base['ai_prob'] - other['ai_prob']))
+        agree += base['is_ai_generated'] == other['is_ai_generated']
+    if not deltas:
+        return {'compared': 0}
+    return {
+        'compared': len(deltas),
+        'mean_abs_drift': round(sum(deltas) / len(deltas), 4),
+        'max_abs_drift': round(max(deltas), 4),
+        'verdict_agreement': round(agree / len(deltas), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare detector inference backends')
+    parser.add_argument('folder', nargs='?', default=SAMPLE_DIR,
+                        help='directory of source files to score')
+    parser.add_argument('--backends', default='torch-int8,onnx',
+                        help='comma-separated backends to compare against fp32 torch')
+    parser.add_argument('--limit', type=int, default=0, help='score at most this many files')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', help='append JSON lines results to this file')
+    args = parser.parse_args()
+
+    codes = load_sample(os.path.abspath(args.folder), args.limit)
+    if not codes:
+        parser.error(f'no supported source files in {args.folder}')
+
+    # The classification head is not in the checkpoint, so every load draws
+    # new random weights; deriving all backends from one load keeps them equal
+    base = _import_two().load_base_model()
+    baseline, timing = score_backend('torch', codes, args.batch_size, base)
+    rows = [{'backend': 'torch', 'files': len(codes), **timing}]
+    for backend in args.backends.split(','):
+        try:
+            results, timing = score_backend(backend, codes, args.batch_size, base)
+        except Exception as e:  # e.g. optimum / onnxruntime not installed
+            rows.append({'backend': backend, 'error': str(e)})
+            continue
+        rows.append({'backend': backend, 'files': len(codes), **timing, **drift(baseline, results)})
+
+    for row in rows:
+        if 'error' in row:
+            print(f"{row['backend']:12} failed: {row['error']}")
+            continue
+        line = (f"{row['backend']:12} {row['seconds']:9.3f}s {row['files_per_second']:>8} files/s "
+                f"{row['windows_per_second']:>8} windows/s")
+        if 'mean_abs_drift' in row:
+            line += (f"  drift mean={row['mean_abs_drift']} max={row['max_abs_drift']}"
+                     f" agree={row['verdict_agreement']}")
+        print(line)
+
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+
+
+if __name__ == '__main__':
+    main()
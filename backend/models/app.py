@@ -1,13 +1,34 @@
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
+import sys
 import time
 from werkzeug.utils import secure_filename
 import traceback
-import ast
+import uuid
+import hashlib
+import sqlite3
+import queue
+import threading
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from difflib import SequenceMatcher
 from itertools import combinations
-from collections import defaultdict
+from collections import Counter, defaultdict, namedtuple, OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # the histogram pre-filter is skipped without NumPy
+    np = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared.ast_features import NODE_TYPES_DIGEST, node_type_ids, subtree_hashes, subtree_similarity
+from shared.metrics import Metrics, instrument_app
+from shared.minhash import LSHIndex, StaleIndexError, minhash
+from shared.parsers import parse_structure, structure_features
+from shared.submissions import IGNORED_PREFIXES, is_text
+from shared.tokenizer import VOCAB_DIGEST, language_for, token_ids
 
 
 app = Flask(__name__)
@@ -20,20 +41,128 @@ if not os.path.exists(UPLOAD_FOLDER):
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
-
-def get_ast_node_types(code_text):
-    try:
-        tree = ast.parse(code_text)
-        return [type(node).__name__ for node in ast.walk(tree)]
-    except:
-        return []
-
-
-def get_token_stream(code_text):
-    return code_text.replace('\n', '').replace('\t', '').replace(' ', '')
-
-
-def compare_ast(code1, code2):
+# Per-file features are kept between runs, bounded and evicted LRU-first
+FEATURE_CACHE_SIZE = 4096
+
+# Winnowing parameters for candidate generation: k-gram length and window
+# size per stream. Any run shared by two files that is at least k + w - 1
+# items long is guaranteed to produce a common fingerprint. The token and
+# AST alphabets are small (a few dozen normalized IDs), so shorter k-grams
+# occur in nearly every file and the index would keep nearly every pair.
+TOKEN_KGRAM, TOKEN_WINDOW = 25, 15
+AST_KGRAM, AST_WINDOW = 16, 8
+# The fingerprint index is opt-in (use_index / ?index=true) because it is
+# lossy: a pair is scored only when, for the token or the AST stream, this
+# share of the smaller file's fingerprints also occurs in the other file, and
+# pairs above the threshold can share less than that
+MIN_FINGERPRINT_OVERLAP = 0.25
+# Starter/template files given to students; their fingerprints are ignored by
+# the index. Fingerprints are never discarded for being common among the
+# submissions, since a solution copied by most of a class is common too
+TEMPLATE_FOLDER = os.path.join(os.path.dirname(UPLOAD_FOLDER), 'templates')
+
+# Pairs whose histogram upper bounds are checked per NumPy batch
+PREFILTER_BATCH = 16384
+
+# Pair scores kept for incremental runs, keyed by file content hashes.
+# Bump SCORE_VERSION whenever scoring changes so stored scores are discarded.
+SCORE_DB_PATH = os.path.join(os.path.dirname(UPLOAD_FOLDER), 'plagiarism_scores.db')
+SCORE_VERSION = 3
+
+# Background plagiarism runs started through /api/run
+JOB_WORKERS = 2
+MAX_FINISHED_JOBS = 50
+
+# Submission folders are listed from a catalog that rescans a folder when its
+# mtime changes or its listing is older than CATALOG_MAX_AGE seconds, and
+# re-reads a file only when its (mtime, size) changes. Files starting with
+# CATALOG_IGNORED_PREFIXES (partial uploads, hidden files) and files that are
+# not UTF-8 text are left out of plagiarism runs, as in the detector's
+# folder=uploads comparison (see shared/submissions.py)
+CATALOG_MAX_AGE = 5.0
+CATALOG_IGNORED_PREFIXES = IGNORED_PREFIXES
+
+# MinHash-LSH index of past cohorts' submissions (see shared/minhash.py)
+HISTORY_DB_PATH = os.path.join(os.path.dirname(UPLOAD_FOLDER), 'submission_history.db')
+HISTORY_TOP_K = 10
+# LSH candidates re-scored exactly per requested match
+HISTORY_SHORTLIST = 4
+# Keeps the AST and token shingles of a file apart
+AST_SHINGLE_SALT = 0x5bd1e995
+# Shingles for history signatures. They are shorter than the index's k-grams
+# so that MinHash still estimates a high similarity for disguised copies
+HISTORY_TOKEN_KGRAM, HISTORY_TOKEN_WINDOW = 12, 8
+HISTORY_AST_KGRAM, HISTORY_AST_WINDOW = 6, 4
+
+# Response formats for ?stream= on /api/run
+STREAM_FORMATS = ('ndjson', 'sse')
+
+# ?report=clusters on /api/run groups matches into clone families, returned
+# a page of families at a time with their strongest CLUSTER_TOP_EDGES matches
+REPORT_FORMATS = ('pairs', 'clusters')
+# Similarity at or above which /api/run reports a match; a lower
+# cluster_threshold would have no matches to link
+RUN_THRESHOLD = 50
+CLUSTER_TOP_EDGES = 5
+CLUSTERS_PER_PAGE = 20
+
+# "sequence" compares AST node-type streams with SequenceMatcher; "subtree"
+# compares multisets of subtree hashes, which also ignores definition order
+AST_SIMILARITY = os.environ.get('AST_SIMILARITY', 'sequence')
+
+# Worker processes for pair scoring; 1 scores in-process, deterministically.
+# They are never forked from this threaded process: a child forked while a
+# request thread holds METRICS' or the feature cache's lock would hang on it
+SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS', os.cpu_count() or 1))
+SCORING_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+# Pairs handed to a worker at a time; runs smaller than this stay in-process
+PAIRS_PER_CHUNK = 2000
+
+Submission = namedtuple('Submission', [
+    'filename', 'path', 'name', 'student_id', 'original_filename', 'size', 'mtime_ns',
+    'digest', 'is_text'
+])
+
+FileFeatures = namedtuple('FileFeatures', [
+    'code', 'digest', 'ast_nodes', 'ast_subtrees', 'tokens', 'ast_fingerprints',
+    'token_fingerprints'
+])
+
+_feature_cache = OrderedDict()   # content digest -> FileFeatures
+_path_index = OrderedDict()      # path -> (mtime_ns, size, digest)
+_feature_cache_lock = threading.Lock()
+
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+_jobs = OrderedDict()            # job id -> job state, oldest first
+_jobs_lock = threading.Lock()
+
+# Served at /api/metrics in the Prometheus text format
+METRICS = Metrics('plagiarism')
+METRICS.histogram('stage_seconds', 'Time per stage: load, parse, tokenize, fingerprint, '
+                  'candidates, prefilter, score_pair, run.')
+METRICS.counter('cache_lookups_total', 'Feature cache lookups by cache and result.')
+METRICS.counter('pairs_considered_total', 'Pairs of submissions in plagiarism runs.')
+METRICS.counter('pairs_pruned_total', 'Pairs dropped before or during scoring, by stage.')
+METRICS.counter('matches_total', 'Pairs at or above the threshold.')
+instrument_app(app, METRICS)
+
+
+def get_ast_node_types(code_text, language=None):
+    """Interned syntax-tree node types as array('H'); empty when code_text
+    does not parse. language is guessed when None."""
+    return structure_features(code_text, language)[0]
+
+
+def get_token_stream(code_text, language=None):
+    """Normalized token IDs; identifiers and literals each map to one ID."""
+    return token_ids(code_text, language)
+
+
+def compare_ast(code1, code2, structural=False):
+    if structural:
+        return subtree_similarity(structure_features(code1, subtrees=True)[1],
+                                  structure_features(code2, subtrees=True)[1]) * 100
     nodes1 = get_ast_node_types(code1)
     nodes2 = get_ast_node_types(code2)
     return SequenceMatcher(None, nodes1, nodes2).ratio() * 100
@@ -45,32 +174,679 @@ def compare_tokens(code1, code2):
     return SequenceMatcher(None, t1, t2).ratio() * 100
 
 
+def hash_values(values):
+    h = 0
+    for v in values:
+        h = (h * 1000003 + v) % ((1 << 61) - 1)
+    return h
+
+
+def kgram_hashes(values, k):
+    """Karp-Rabin rolling hashes of every k-gram in a sequence of ints."""
+    if len(values) < k:
+        return [hash_values(values)] if values else []
+    mod = (1 << 61) - 1
+    base = 1000003
+    top = pow(base, k - 1, mod)
+    h = hash_values(values[:k])
+    hashes = [h]
+    for i in range(k, len(values)):
+        h = ((h - values[i - k] * top) * base + values[i]) % mod
+        hashes.append(h)
+    return hashes
+
+
+def winnow(hashes, window):
+    """Select the minimum hash of every window (Schleimer et al., 2003)."""
+    if len(hashes) <= window:
+        return frozenset([min(hashes)]) if hashes else frozenset()
+    return frozenset(min(hashes[i:i + window]) for i in range(len(hashes) - window + 1))
+
+
+def get_fingerprints(ast_nodes, tokens):
+    ast_values = list(ast_nodes)
+    token_values = list(tokens)
+    return (
+        winnow(kgram_hashes(ast_values, AST_KGRAM), AST_WINDOW),
+        winnow(kgram_hashes(token_values, TOKEN_KGRAM), TOKEN_WINDOW),
+    )
+
+
 def load_code(path):
     with open(path, 'r', encoding='utf-8') as file:
         return file.read()
 
 
-def compare_all_submissions(folder_path, threshold=50):
-    files = [f for f in os.listdir(folder_path)]
-    matches = []
-    leaderboard_counter = defaultdict(int)
+def _cache_put(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > FEATURE_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def get_file_features(path):
+    """Return the cached FileFeatures for path, reading and parsing it only
+    when its (mtime, size) or content hash has not been seen before."""
+    stat = os.stat(path)
+    with _feature_cache_lock:
+        entry = _path_index.get(path)
+        if entry and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            features = _feature_cache.get(entry[2])
+            if features is not None:
+                _path_index.move_to_end(path)
+                _feature_cache.move_to_end(entry[2])
+                METRICS.inc('cache_lookups_total', cache='path', result='hit')
+                return features
+    METRICS.inc('cache_lookups_total', cache='path', result='miss')
+
+    with METRICS.timer('stage_seconds', stage='load'):
+        code = load_code(path)
+    features = get_code_features(code, language_for(path))
+    with _feature_cache_lock:
+        _cache_put(_path_index, path, (stat.st_mtime_ns, stat.st_size, features.digest))
+    return features
+
+
+def submission_features(submission):
+    """FileFeatures of a catalog Submission. Its digest finds features that
+    are already cached without another stat or read of the file."""
+    with _feature_cache_lock:
+        features = _feature_cache.get(submission.digest)
+        if features is not None:
+            _feature_cache.move_to_end(submission.digest)
+    if features is not None:
+        METRICS.inc('cache_lookups_total', cache='catalog', result='hit')
+        return features
+    return get_file_features(submission.path)
+
+
+def get_code_features(code, language=None):
+    """Return the cached FileFeatures for a source text."""
+    digest = hashlib.sha1(code.encode('utf-8')).hexdigest()
+    with _feature_cache_lock:
+        features = _feature_cache.get(digest)
+        if features is not None:
+            _feature_cache.move_to_end(digest)
+    METRICS.inc('cache_lookups_total', cache='feature',
+                result='miss' if features is None else 'hit')
+    if features is not None:
+        return features
+
+    # Computed without the lock so other threads' lookups are not held up
+    with METRICS.timer('stage_seconds', stage='parse'):
+        tree = parse_structure(code, language)
+        ast_nodes = node_type_ids(tree)
+        ast_subtrees = subtree_hashes(tree) if AST_SIMILARITY == 'subtree' else array('q')
+    with METRICS.timer('stage_seconds', stage='tokenize'):
+        tokens = get_token_stream(code, language)
+    with METRICS.timer('stage_seconds', stage='fingerprint'):
+        ast_fingerprints, token_fingerprints = get_fingerprints(ast_nodes, tokens)
+    features = FileFeatures(
+        code=code,
+        digest=digest,
+        ast_nodes=ast_nodes,
+        ast_subtrees=ast_subtrees,
+        tokens=tokens,
+        ast_fingerprints=ast_fingerprints,
+        token_fingerprints=token_fingerprints,
+    )
+    with _feature_cache_lock:
+        # Another thread may have computed the same source meanwhile
+        features = _feature_cache.get(digest, features)
+        _cache_put(_feature_cache, digest, features)
+    return features
+
+
+def clear_feature_cache():
+    with _feature_cache_lock:
+        _feature_cache.clear()
+        _path_index.clear()
+
+
+def _length_bound(a, b):
+    # Same value as SequenceMatcher.real_quick_ratio, without building one
+    total = len(a) + len(b)
+    return 2.0 * min(len(a), len(b)) / total if total else 1.0
+
+
+class _SubtreeMatcher:
+    """SequenceMatcher stand-in for subtree hash multisets; their similarity
+    is cheap to compute exactly, so quick_ratio() is already the ratio."""
+
+    def __init__(self, hashes1, hashes2):
+        self._ratio = subtree_similarity(hashes1, hashes2)
+
+    def quick_ratio(self):
+        return self._ratio
 
-    for f1, f2 in combinations(files, 2):
-        code1 = load_code(os.path.join(folder_path, f1))
-        code2 = load_code(os.path.join(folder_path, f2))
+    ratio = quick_ratio
 
-        ast_score = compare_ast(code1, code2)
-        token_score = compare_tokens(code1, code2)
-        avg_similarity = round((ast_score + token_score) / 2, 2)
 
-        if avg_similarity >= threshold:
-            matches.append({
+def _ast_sequence(feat):
+    return feat.ast_subtrees if AST_SIMILARITY == 'subtree' else feat.ast_nodes
+
+
+def _ast_matcher(feat1, feat2):
+    if AST_SIMILARITY == 'subtree':
+        return _SubtreeMatcher(feat1.ast_subtrees, feat2.ast_subtrees)
+    return SequenceMatcher(None, feat1.ast_nodes, feat2.ast_nodes)
+
+
+def score_features(feat1, feat2, threshold=None, stats=None):
+    """Average AST and token similarity of two files, rounded to 2 decimals.
+
+    With a threshold, cheap upper bounds are checked first (lengths, then
+    quick_ratio, then the exact AST ratio with the token quick_ratio) and
+    None is returned as soon as the pair can no longer reach it. The stage
+    that pruned the pair is counted in stats. Pairs that pass get their
+    exact score.
+    """
+    # SequenceMatcher is not symmetric; a fixed order keeps a pair's score
+    # independent of directory listing order, so stored scores stay valid
+    if feat1.digest > feat2.digest:
+        feat1, feat2 = feat2, feat1
+
+    if threshold is None:
+        ast_score = _ast_matcher(feat1, feat2).ratio() * 100
+        token_score = SequenceMatcher(None, feat1.tokens, feat2.tokens).ratio() * 100
+        return round((ast_score + token_score) / 2, 2)
+
+    # Scores are rounded before the threshold check, so allow for that
+    floor = 2 * threshold - 0.02
+    if (_length_bound(_ast_sequence(feat1), _ast_sequence(feat2)) +
+            _length_bound(feat1.tokens, feat2.tokens)) * 100 < floor:
+        return _pruned(stats, 'real_quick_ratio')
+
+    ast_sm = _ast_matcher(feat1, feat2)
+    token_sm = SequenceMatcher(None, feat1.tokens, feat2.tokens)
+    token_quick = token_sm.quick_ratio() * 100
+    if ast_sm.quick_ratio() * 100 + token_quick < floor:
+        return _pruned(stats, 'quick_ratio')
+
+    ast_score = ast_sm.ratio() * 100
+    if ast_score + token_quick < floor:
+        return _pruned(stats, 'ast_ratio')
+
+    token_score = token_sm.ratio() * 100
+    return round((ast_score + token_score) / 2, 2)
+
+
+def _pruned(stats, stage):
+    if stats is not None:
+        stats[stage] += 1
+    return None
+
+
+def score_pairs(feature_list, pairs, threshold, stats=None):
+    """Score (i, j) index pairs and return the (i, j, score) hits above threshold."""
+    hits = []
+    for i, j in pairs:
+        with METRICS.timer('stage_seconds', stage='score_pair'):
+            score = score_features(feature_list[i], feature_list[j], threshold, stats)
+        if score is None:
+            continue
+        if score >= threshold:
+            hits.append((i, j, score))
+        elif stats is not None:
+            stats['below_threshold'] += 1
+    return hits
+
+
+_worker_features = None
+
+
+def _init_scoring_worker(feature_list):
+    global _worker_features
+    _worker_features = feature_list
+    # Only this worker's own timings are sent back
+    METRICS.snapshot(reset=True)
+
+
+def _score_chunk(pairs, threshold):
+    stats = Counter()
+    hits = score_pairs(_worker_features, pairs, threshold, stats)
+    # The worker's timings travel back with its results
+    return hits, stats, METRICS.snapshot(reset=True)
+
+
+def _score_chunk_local(feature_list, pairs, threshold):
+    stats = Counter()
+    hits = score_pairs(feature_list, pairs, threshold, stats)
+    return hits, stats, None
+
+
+def _collect_chunks(chunks, chunk_results, on_chunk, stats):
+    hits = []
+    for chunk, (chunk_hits, chunk_stats, metrics) in zip(chunks, chunk_results):
+        hits.extend(chunk_hits)
+        if metrics is not None:
+            METRICS.merge(metrics)
+        if stats is not None:
+            stats.update(chunk_stats)
+        if on_chunk:
+            on_chunk(len(chunk), chunk_hits)
+    return hits
+
+
+def score_pairs_parallel(feature_list, pairs, threshold, workers=None, on_chunk=None,
+                         stats=None):
+    """Split pairs into chunks across a process pool.
+
+    Each worker receives the features once through the pool initializer, so
+    only index pairs travel per chunk. Hits come back in the order of pairs,
+    and on_chunk(n_pairs, chunk_hits) is called as each chunk completes.
+    Per-stage pruning counts from the workers are added to stats.
+    """
+    workers = SCORING_WORKERS if workers is None else workers
+    pairs = list(pairs)
+    chunks = [pairs[k:k + PAIRS_PER_CHUNK] for k in range(0, len(pairs), PAIRS_PER_CHUNK)]
+    if workers <= 1 or len(chunks) <= 1:
+        chunk_results = (_score_chunk_local(feature_list, chunk, threshold) for chunk in chunks)
+        return _collect_chunks(chunks, chunk_results, on_chunk, stats)
+
+    # Workers only need the sequences that SequenceMatcher compares
+    slim = [f._replace(code=None, ast_fingerprints=None, token_fingerprints=None)
+            for f in feature_list]
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(chunks)),
+                                   mp_context=SCORING_MP_CONTEXT,
+                                   initializer=_init_scoring_worker,
+                                   initargs=(slim,))
+    try:
+        chunk_results = executor.map(_score_chunk, chunks, [threshold] * len(chunks))
+        return _collect_chunks(chunks, chunk_results, on_chunk, stats)
+    finally:
+        # If on_chunk raised (e.g. a cancelled stream), drop the queued chunks
+        # instead of scoring them all before unwinding
+        executor.shutdown(cancel_futures=True)
+
+
+def _overlapping_pairs(fingerprint_sets, min_overlap, focus=None, ignored=frozenset()):
+    """Find index pairs sharing at least min_overlap of the smaller file's
+    fingerprints, using an inverted index from fingerprint to files. With
+    focus, only pairs involving one of those indices are considered.
+    Fingerprints in ignored (template code) do not count."""
+    if ignored:
+        fingerprint_sets = [fingerprints - ignored for fingerprints in fingerprint_sets]
+    index = defaultdict(list)
+    for i, fingerprints in enumerate(fingerprint_sets):
+        for fp in fingerprints:
+            index[fp].append(i)
+
+    shared = defaultdict(int)
+    for fp, postings in index.items():
+        if len(postings) > 1:
+            for pair in combinations(postings, 2):
+                if focus is None or pair[0] in focus or pair[1] in focus:
+                    shared[pair] += 1
+
+    sizes = [len(fingerprints) for fingerprints in fingerprint_sets]
+    return {
+        (i, j) for (i, j), count in shared.items()
+        if count >= min_overlap * min(sizes[i], sizes[j])
+    }
+
+
+def template_features(folder_path=None):
+    """FileFeatures of the starter/template files, if any were provided."""
+    folder = folder_path or TEMPLATE_FOLDER
+    if not os.path.isdir(folder):
+        return []
+    return [submission_features(s) for s in catalog.submissions(folder)]
+
+
+def candidate_pairs(feature_list, min_overlap=MIN_FINGERPRINT_OVERLAP, focus=None,
+                    templates=()):
+    """Return the (i, j) index pairs worth exact scoring, in combinations() order.
+
+    This is a lossy filter: pairs sharing little winnowed text can still
+    score above the threshold. Fingerprints of templates are ignored.
+    """
+    candidates = set()
+    for attr in ('ast_fingerprints', 'token_fingerprints'):
+        fingerprint_sets = [getattr(f, attr) for f in feature_list]
+        ignored = frozenset().union(*(getattr(t, attr) for t in templates))
+        candidates |= _overlapping_pairs(fingerprint_sets, min_overlap, focus, ignored)
+    return sorted(candidates)
+
+
+def _histogram_matrix(sequences):
+    """Count matrix with one row per sequence and one column per distinct item."""
+    vocab = {}
+    counters = [Counter(seq) for seq in sequences]
+    for counts in counters:
+        for item in counts:
+            vocab.setdefault(item, len(vocab))
+    matrix = np.zeros((len(sequences), max(len(vocab), 1)), dtype=np.int32)
+    for row, counts in enumerate(counters):
+        for item, count in counts.items():
+            matrix[row, vocab[item]] = count
+    return matrix
+
+
+def _ratio_bounds(histograms, lengths, i, j):
+    # 2 * |multiset intersection| / (len1 + len2) is SequenceMatcher.quick_ratio,
+    # which never underestimates ratio(); two empty sequences have ratio 1.0
+    common = np.minimum(histograms[i], histograms[j]).sum(axis=1)
+    total = lengths[i] + lengths[j]
+    return np.where(total > 0, 200.0 * common / np.maximum(total, 1), 100.0)
+
+
+def similarity_upper_bounds(feature_list, pairs):
+    """Upper bound of score_features for every (i, j) pair, computed in batches
+    from AST node-type and token-ID histograms."""
+    if AST_SIMILARITY == 'subtree':
+        # Too many distinct subtree hashes for a dense histogram; a single
+        # column of counts reduces the bound to the length bound
+        ast_hist = np.array([len(f.ast_subtrees) for f in feature_list],
+                            dtype=np.int32).reshape(-1, 1)
+    else:
+        ast_hist = _histogram_matrix([f.ast_nodes for f in feature_list])
+    token_hist = _histogram_matrix([f.tokens for f in feature_list])
+    ast_len = ast_hist.sum(axis=1)
+    token_len = token_hist.sum(axis=1)
+
+    index = np.asarray(pairs, dtype=np.intp).reshape(-1, 2)
+    bounds = np.empty(len(index))
+    for start in range(0, len(index), PREFILTER_BATCH):
+        i = index[start:start + PREFILTER_BATCH, 0]
+        j = index[start:start + PREFILTER_BATCH, 1]
+        bounds[start:start + PREFILTER_BATCH] = (
+            _ratio_bounds(ast_hist, ast_len, i, j) +
+            _ratio_bounds(token_hist, token_len, i, j)
+        ) / 2
+    return bounds
+
+
+def histogram_prefilter(feature_list, pairs, threshold):
+    """Drop pairs that cannot reach threshold; the bound is exact, so no
+    pair that would have matched is lost."""
+    if np is None or not pairs or threshold <= 0:
+        return pairs
+    bounds = similarity_upper_bounds(feature_list, pairs)
+    # Scores are rounded to 2 decimals before the threshold check
+    keep = bounds >= threshold - 0.01
+    return [pair for pair, ok in zip(pairs, keep) if ok]
+
+
+def _open_score_store(db_path=None):
+    conn = sqlite3.connect(db_path or SCORE_DB_PATH, timeout=30)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(pair_scores)')}
+    if columns and 'config' not in columns:
+        # Scores stored before they were keyed by config; rescore every folder
+        conn.executescript('DROP TABLE pair_scores; DELETE FROM corpus_config;')
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS pair_scores (
+            config TEXT NOT NULL,
+            digest_a TEXT NOT NULL,
+            digest_b TEXT NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (config, digest_a, digest_b)
+        );
+        CREATE TABLE IF NOT EXISTS corpus (
+            folder TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            PRIMARY KEY (folder, digest)
+        );
+        CREATE TABLE IF NOT EXISTS corpus_config (
+            folder TEXT PRIMARY KEY,
+            config TEXT NOT NULL
+        );
+    ''')
+    return conn
+
+
+def _digest_key(d1, d2):
+    return (d1, d2) if d1 <= d2 else (d2, d1)
+
+
+def load_score_store(folder_path, config, digests, db_path=None):
+    """Return (known_digests, stored_scores) from the last incremental run over
+    folder_path, or empty results when it was made with a different config.
+    Only scores made with config between two of digests are read."""
+    folder = os.path.abspath(folder_path)
+    conn = _open_score_store(db_path)
+    try:
+        row = conn.execute('SELECT config FROM corpus_config WHERE folder = ?',
+                           (folder,)).fetchone()
+        if row is None or row[0] != config:
+            return set(), {}
+        known = {d for (d,) in conn.execute('SELECT digest FROM corpus WHERE folder = ?',
+                                            (folder,))}
+        conn.execute('CREATE TEMP TABLE current_digests (digest TEXT PRIMARY KEY)')
+        conn.executemany('INSERT OR IGNORE INTO current_digests (digest) VALUES (?)',
+                         [(d,) for d in digests if d in known])
+        scores = {(a, b): score for a, b, score in conn.execute('''
+            SELECT p.digest_a, p.digest_b, p.score FROM pair_scores p
+            JOIN current_digests a ON a.digest = p.digest_a
+            JOIN current_digests b ON b.digest = p.digest_b
+            WHERE p.config = ?
+        ''', (config,))}
+    finally:
+        conn.close()
+    return known, scores
+
+
+def save_score_store(folder_path, config, digests, new_scores, db_path=None):
+    """Record the folder's current corpus and newly scored pairs, and drop
+    scores for content no longer present in any tracked folder."""
+    folder = os.path.abspath(folder_path)
+    conn = _open_score_store(db_path)
+    try:
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO corpus_config (folder, config) VALUES (?, ?)',
+                         (folder, config))
+            conn.execute('DELETE FROM corpus WHERE folder = ?', (folder,))
+            conn.executemany('INSERT INTO corpus (folder, digest) VALUES (?, ?)',
+                             [(folder, d) for d in set(digests)])
+            conn.executemany('INSERT OR REPLACE INTO pair_scores (config, digest_a, digest_b, score) '
+                             'VALUES (?, ?, ?, ?)',
+                             [(config, a, b, score) for (a, b), score in new_scores.items()])
+            conn.execute('''
+                DELETE FROM pair_scores
+                WHERE digest_a NOT IN (SELECT digest FROM corpus)
+                   OR digest_b NOT IN (SELECT digest FROM corpus)
+                   OR config NOT IN (SELECT config FROM corpus_config)
+            ''')
+    finally:
+        conn.close()
+
+
+def _read_submission(path, filename, stat):
+    with open(path, 'rb') as f:
+        data = f.read()
+    text = is_text(data)
+    if text:
+        # load_code reads with universal newlines; hash the same text so the
+        # digest is FileFeatures.digest
+        data = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n').encode('utf-8')
+    # Stored as <name>_<id>_<original file name>; the file name may contain '_'
+    parts = filename.split('_', 2)
+    name, student_id, original = parts if len(parts) == 3 else (None, None, None)
+    return Submission(
+        filename=filename,
+        path=path,
+        name=name,
+        student_id=student_id,
+        original_filename=original,
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        digest=hashlib.sha1(data).hexdigest(),
+        is_text=text,
+    )
+
+
+class SubmissionCatalog:
+    """Cached, parsed listing of submission folders."""
+
+    def __init__(self, max_age=CATALOG_MAX_AGE):
+        self.max_age = max_age
+        self._folders = {}   # folder -> (mtime_ns, scanned at, {filename: Submission})
+        self._lock = threading.Lock()
+
+    def entries(self, folder_path):
+        """Every regular file in folder_path as a Submission, by file name."""
+        folder = os.path.abspath(folder_path)
+        with self._lock:
+            mtime = os.stat(folder).st_mtime_ns
+            state = self._folders.get(folder)
+            if state is None or state[0] != mtime or time.monotonic() - state[1] > self.max_age:
+                records = self._scan(folder, state[2] if state else {})
+                state = self._folders[folder] = (mtime, time.monotonic(), records)
+        return [state[2][filename] for filename in sorted(state[2])]
+
+    def submissions(self, folder_path):
+        """The entries worth comparing: UTF-8 text, no ignored prefixes."""
+        return [s for s in self.entries(folder_path)
+                if s.is_text and not s.filename.startswith(CATALOG_IGNORED_PREFIXES)]
+
+    def clear(self):
+        with self._lock:
+            self._folders.clear()
+
+    @staticmethod
+    def _scan(folder, previous):
+        records = {}
+        with os.scandir(folder) as it:
+            for entry in it:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    old = previous.get(entry.name)
+                    if old is not None and (old.mtime_ns, old.size) == (stat.st_mtime_ns, stat.st_size):
+                        records[entry.name] = old
+                    else:
+                        records[entry.name] = _read_submission(entry.path, entry.name, stat)
+                except OSError:  # removed while scanning
+                    continue
+        return records
+
+
+catalog = SubmissionCatalog()
+
+
+def compare_all_submissions(folder_path, threshold=RUN_THRESHOLD, use_index=False, workers=None,
+                            progress=None, incremental=False, prefilter=True,
+                            keep_matches=True):
+    """Score every pair of submissions in folder_path.
+
+    progress, if given, is called as progress(pairs_processed, pairs_total,
+    new_matches) once before scoring starts and after every scored chunk.
+    With keep_matches=False matches are only passed to progress, and the
+    returned "matches" list stays empty.
+
+    With incremental=True only files whose content is new since the last
+    incremental run are scored, against every file; scores for unchanged
+    pairs are read back from the score store.
+
+    use_index=True only scores pairs found by the fingerprint index, which
+    skips most pairs but can miss matches (see MIN_FINGERPRINT_OVERLAP).
+    The histogram prefilter never drops a pair that reaches threshold.
+    """
+    run_started = time.perf_counter()
+    submissions = catalog.submissions(folder_path)
+    files = [s.filename for s in submissions]
+    matches = []
+    leaderboard_counter = defaultdict(int)
+
+    # Read and parse every file once, then reuse the features for each pair
+    feature_list = [submission_features(s) for s in submissions]
+    templates = template_features() if use_index else []
+
+    focus = None
+    reused_hits = []
+    unscored_duplicates = []
+    if incremental:
+        # Pruned pairs are never stored, so pruning settings are part of the config
+        index_config = (f'{TOKEN_KGRAM}/{TOKEN_WINDOW}/{AST_KGRAM}/{AST_WINDOW}/'
+                        + ','.join(sorted(t.digest for t in templates))) if use_index else '0'
+        config = f'{SCORE_VERSION}:{AST_SIMILARITY}:{index_config}:{int(prefilter)}:{threshold}'
+        known, stored_scores = load_score_store(folder_path, config,
+                                                [f.digest for f in feature_list])
+        focus = {i for i, f in enumerate(feature_list) if f.digest not in known}
+
+        # Pairs of unchanged files keep their stored score; unchanged pairs
+        # without one were pruned by the index on an earlier run
+        unchanged = defaultdict(list)
+        for i, f in enumerate(feature_list):
+            if i not in focus:
+                unchanged[f.digest].append(i)
+        for (d1, d2), score in stored_scores.items():
+            for i in unchanged.get(d1, ()):
+                for j in unchanged.get(d2, ()):
+                    if i != j and (d1 != d2 or i < j):
+                        reused_hits.append((min(i, j), max(i, j), score))
+        reused_hits.sort()
+        # Identical copies of an unchanged file have never been scored together
+        for digest, indices in unchanged.items():
+            if len(indices) > 1 and (digest, digest) not in stored_scores:
+                unscored_duplicates.extend(combinations(indices, 2))
+
+    if focus is not None:
+        n_focus = len(focus)
+        possible_pairs = n_focus * (len(files) - n_focus) + n_focus * (n_focus - 1) // 2
+    else:
+        possible_pairs = len(files) * (len(files) - 1) // 2
+    pruning = Counter()
+
+    # Winnowed fingerprints narrow the pair space down to likely matches
+    with METRICS.timer('stage_seconds', stage='candidates'):
+        if use_index:
+            pairs = candidate_pairs(feature_list, focus=focus, templates=templates)
+        elif focus is not None:
+            pairs = [(i, j) for i, j in combinations(range(len(files)), 2)
+                     if i in focus or j in focus]
+        else:
+            pairs = list(combinations(range(len(files)), 2))
+    pruning['fingerprint_index'] = possible_pairs - len(pairs)
+
+    # Histogram bounds rule out the remaining pairs that cannot reach threshold
+    if prefilter:
+        n_before = len(pairs)
+        with METRICS.timer('stage_seconds', stage='prefilter'):
+            pairs = histogram_prefilter(feature_list, pairs, threshold)
+        pruning['histogram_bound'] = n_before - len(pairs)
+    if unscored_duplicates:
+        pairs = sorted(set(pairs) | set(unscored_duplicates))
+
+    pairs_total = len(pairs) + len(reused_hits)
+    pairs_processed = 0
+    if progress:
+        progress(0, pairs_total, [])
+
+    def on_chunk(n_pairs, hits):
+        nonlocal pairs_processed
+        new_matches = []
+        for i, j, avg_similarity in hits:
+            if avg_similarity < threshold:
+                continue
+            f1, f2 = files[i], files[j]
+            new_matches.append({
                 "student_1": f1,
                 "student_2": f2,
                 "similarity_percent": avg_similarity
             })
             leaderboard_counter[f1] += 1
             leaderboard_counter[f2] += 1
+        if keep_matches:
+            matches.extend(new_matches)
+        pairs_processed += n_pairs
+        if progress:
+            progress(pairs_processed, pairs_total, new_matches)
+
+    if not incremental:
+        score_pairs_parallel(feature_list, pairs, threshold, workers, on_chunk=on_chunk,
+                             stats=pruning)
+    else:
+        on_chunk(len(reused_hits), reused_hits)
+        # Only hits are stored; the threshold is part of the store config
+        scored = score_pairs_parallel(feature_list, pairs, threshold, workers,
+                                      on_chunk=on_chunk, stats=pruning)
+        new_scores = {
+            _digest_key(feature_list[i].digest, feature_list[j].digest): score
+            for i, j, score in scored
+        }
+        save_score_store(folder_path, config, [f.digest for f in feature_list], new_scores)
 
     leaderboard = sorted(
         [{"student": student, "sim_count": count}
@@ -79,29 +855,172 @@ def compare_all_submissions(folder_path, threshold=50):
         reverse=True
     )
 
+    METRICS.inc('pairs_considered_total', possible_pairs)
+    for stage, count in pruning.items():
+        METRICS.inc('pairs_pruned_total', count, stage=stage)
+    METRICS.inc('matches_total', sum(leaderboard_counter.values()) // 2)
+    METRICS.observe('stage_seconds', time.perf_counter() - run_started, stage='run')
+
     return {
         "matches": matches,
-        "leaderboard": leaderboard
+        "leaderboard": leaderboard,
+        "pruning": dict(pruning)
+    }
+
+
+def history_signature(features):
+    """MinHash signature over a file's winnowed token and AST k-grams."""
+    shingles = set(winnow(kgram_hashes(list(features.tokens), HISTORY_TOKEN_KGRAM),
+                          HISTORY_TOKEN_WINDOW))
+    shingles.update(h ^ AST_SHINGLE_SALT for h in winnow(
+        kgram_hashes(list(features.ast_nodes), HISTORY_AST_KGRAM), HISTORY_AST_WINDOW))
+    return minhash(shingles)
+
+
+def open_history_index(db_path=None):
+    # Signatures depend on how fingerprints are made, including the node and
+    # token ID tables of the running interpreter
+    config = (f'{SCORE_VERSION}:{HISTORY_TOKEN_KGRAM}:{HISTORY_TOKEN_WINDOW}:'
+              f'{HISTORY_AST_KGRAM}:{HISTORY_AST_WINDOW}:{NODE_TYPES_DIGEST}:{VOCAB_DIGEST}')
+    return LSHIndex(db_path or HISTORY_DB_PATH, config)
+
+
+def add_to_history(folder_path, label, db_path=None):
+    """Add every submission in folder_path to the history index under label
+    (e.g. "2024-hw3"). Returns the number of entries and of new sources."""
+    index = open_history_index(db_path)
+    items = []
+    for submission in catalog.submissions(folder_path):
+        features = submission_features(submission)
+        items.append((label, submission.filename, features.digest,
+                      language_for(submission.filename), features.code,
+                      history_signature(features)))
+    added = index.add_many(items)
+    return {'label': label, 'entries': len(items), 'new_sources': added}
+
+
+def query_history(features, k=HISTORY_TOP_K, threshold=50, exclude_label=None, index=None):
+    """Top-k past submissions most similar to features, by exact score.
+
+    The LSH index shortlists HISTORY_SHORTLIST * k candidates by estimated
+    similarity; only those are scored with score_features. Sources whose
+    only entries are labelled exclude_label (usually the current cohort)
+    are skipped.
+    """
+    index = index or open_history_index()
+    shortlist = index.query(history_signature(features), k * HISTORY_SHORTLIST, exclude_label)
+    estimates = dict(shortlist)
+    sources = index.sources(estimates)
+    hits = []
+    for source, (digest, language, code) in sources.items():
+        score = score_features(features, get_code_features(code, language), threshold)
+        if score is not None and score >= threshold:
+            hits.append((score, source))
+    hits.sort(key=lambda hit: (-hit[0], hit[1]))
+    hits = hits[:k]
+    entries = index.entries([source for _, source in hits], exclude_label)
+    return [{
+        'submissions': [{'label': label, 'name': name} for label, name in entries.get(source, [])],
+        'similarity_percent': score,
+        'estimated_similarity': round(estimates[source], 3),
+    } for score, source in hits]
+
+
+def cluster_matches(matches, threshold=0, top_edges=CLUSTER_TOP_EDGES):
+    """Group matched submissions into clone families.
+
+    Families are the connected components (union-find) of the graph of
+    matches at or above threshold, i.e. single-linkage clusters. Each has
+    a representative, the member with the highest total similarity to the
+    others. Largest families come first.
+    """
+    parent = {}
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    edges = [m for m in matches if m['similarity_percent'] >= threshold]
+    for m in edges:
+        a, b = m['student_1'], m['student_2']
+        parent.setdefault(a, a)
+        parent.setdefault(b, b)
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    families = defaultdict(list)
+    for m in edges:
+        families[find(m['student_1'])].append(m)
+
+    clusters = []
+    for family in families.values():
+        strength = defaultdict(float)
+        for m in family:
+            strength[m['student_1']] += m['similarity_percent']
+            strength[m['student_2']] += m['similarity_percent']
+        family.sort(key=lambda m: (-m['similarity_percent'], m['student_1'], m['student_2']))
+        similarities = [m['similarity_percent'] for m in family]
+        clusters.append({
+            'representative': min(strength, key=lambda s: (-strength[s], s)),
+            'size': len(strength),
+            'members': sorted(strength),
+            'match_count': len(family),
+            'max_similarity': max(similarities),
+            'mean_similarity': round(sum(similarities) / len(similarities), 2),
+            'strongest_matches': family[:top_edges],
+        })
+    clusters.sort(key=lambda c: (-c['size'], -c['max_similarity'], c['representative']))
+    return [{'cluster_id': n, **c} for n, c in enumerate(clusters, 1)]
+
+
+def cluster_results(results, threshold):
+    """Split compare_all_submissions results into a summary without the
+    match list and the clone families built from it."""
+    summary = {key: value for key, value in results.items() if key != 'matches'}
+    summary['match_count'] = len(results['matches'])
+    summary['cluster_threshold'] = threshold
+    return summary, cluster_matches(results['matches'], threshold)
+
+
+def cluster_page(summary, clusters, page=1, per_page=CLUSTERS_PER_PAGE):
+    start = (page - 1) * per_page
+    return {
+        **summary,
+        'cluster_count': len(clusters),
+        'page': page,
+        'per_page': per_page,
+        'pages': max(1, -(-len(clusters) // per_page)),
+        'clusters': clusters[start:start + per_page],
     }
 
 
+def _page_params():
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', CLUSTERS_PER_PAGE))
+    except ValueError:
+        raise ValueError('page and per_page must be integers')
+    if page < 1 or per_page < 1:
+        raise ValueError('page and per_page must be at least 1')
+    return page, per_page
+
+
 @app.route('/api/codes', methods=['GET'])
 def send_codes():
     try:
-        files = os.listdir(UPLOAD_FOLDER)
-        submissions = []
-
-        for file in files:
-            parts = file.split('_')
-            if len(parts) == 3:
-                student_name = parts[0]
-                student_id = parts[1]
-                filename = parts[2]
-                submissions.append({
-                    'name': student_name,
-                    'id': student_id,
-                    'filename': filename
-                })
+        submissions = [{
+            'name': s.name,
+            'id': s.student_id,
+            'filename': s.original_filename,
+            'size': s.size,
+            'is_text': s.is_text,
+        } for s in catalog.entries(UPLOAD_FOLDER)
+            if s.name is not None and not s.filename.startswith(CATALOG_IGNORED_PREFIXES)]
 
         return jsonify(submissions), 200
 
@@ -147,17 +1066,332 @@ def download_file():
         return jsonify({'error': 'Failed to download file', 'details': str(e)}), 500
 
 
+def _job_status(job):
+    """Build the JSON body for a job that is still queued or running."""
+    eta = None
+    if job['pairs_total'] and job['pairs_processed'] and job['scoring_started']:
+        elapsed = time.time() - job['scoring_started']
+        remaining = job['pairs_total'] - job['pairs_processed']
+        eta = round(elapsed / job['pairs_processed'] * remaining, 1)
+    return {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'pairs_processed': job['pairs_processed'],
+        'pairs_total': job['pairs_total'],
+        'eta_seconds': eta,
+        'matches': list(job['matches']),
+    }
+
+
+def _run_job(job, folder_path, incremental=False, cluster_threshold=None, use_index=False):
+    def progress(pairs_processed, pairs_total, new_matches):
+        with _jobs_lock:
+            if job['scoring_started'] is None:
+                job['scoring_started'] = time.time()
+            job['pairs_processed'] = pairs_processed
+            job['pairs_total'] = pairs_total
+            job['matches'].extend(new_matches)
+
+    with _jobs_lock:
+        job['status'] = 'running'
+    clusters = None
+    try:
+        results = compare_all_submissions(folder_path, progress=progress,
+                                          incremental=incremental, use_index=use_index)
+        if cluster_threshold is not None:
+            results, clusters = cluster_results(results, cluster_threshold)
+        body = {
+            'job_id': job['job_id'],
+            'status': 'done',
+            'pairs_processed': job['pairs_processed'],
+            'pairs_total': job['pairs_total'],
+            'eta_seconds': 0,
+            'elapsed_seconds': round(time.time() - job['created'], 2),
+            **results,
+        }
+        code = 200
+    except Exception as e:
+        app.logger.error(f"Error in plagiarism job {job['job_id']}: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        body = {
+            'job_id': job['job_id'],
+            'status': 'error',
+            'error': 'Server error during plagiarism check',
+            'details': str(e),
+        }
+        code = 500
+
+    # Serialize once; later polls return the stored body as-is. Cluster
+    # reports are paged, so their pages are cut from the families per poll
+    # and the response only marks the job finished
+    payload = app.json.dumps(body) if clusters is None else None
+    with _jobs_lock:
+        job['status'] = body['status']
+        job['clusters'] = None if clusters is None else (body, clusters)
+        job['response'] = (payload, code)
+        job['matches'] = []
+        finished = [j for j in _jobs.values() if j['response'] is not None]
+        for old in finished[:-MAX_FINISHED_JOBS]:
+            del _jobs[old['job_id']]
+
+
+def start_plagiarism_job(folder_path, incremental=False, cluster_threshold=None, use_index=False):
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'status': 'queued',
+        'created': time.time(),
+        'scoring_started': None,
+        'pairs_processed': 0,
+        'pairs_total': None,
+        'matches': [],
+        'response': None,
+        'clusters': None,
+    }
+    with _jobs_lock:
+        _jobs[job['job_id']] = job
+    _job_executor.submit(_run_job, job, folder_path, incremental, cluster_threshold, use_index)
+    return job['job_id']
+
+
+class RunCancelled(Exception):
+    pass
+
+
+def stream_plagiarism_run(folder_path, incremental=False, use_index=False):
+    """Run a plagiarism check and yield a "match" record for each match as
+    its chunk is scored, then a "summary" record with the leaderboard.
+
+    The run happens on the job executor; closing the generator (the client
+    went away) stops it after the current chunk.
+    """
+    records = queue.Queue()
+    cancelled = threading.Event()
+    started = time.time()
+    counts = {'matches_found': 0, 'pairs_processed': 0, 'pairs_total': None}
+
+    def progress(pairs_processed, pairs_total, new_matches):
+        if cancelled.is_set():
+            raise RunCancelled()
+        counts['matches_found'] += len(new_matches)
+        counts['pairs_processed'] = pairs_processed
+        counts['pairs_total'] = pairs_total
+        for match in new_matches:
+            records.put({'type': 'match', **match})
+
+    def run():
+        try:
+            results = compare_all_submissions(folder_path, progress=progress,
+                                              incremental=incremental, use_index=use_index,
+                                              keep_matches=False)
+            records.put({
+                'type': 'summary',
+                **counts,
+                'leaderboard': results['leaderboard'],
+                'pruning': results['pruning'],
+                'elapsed_seconds': round(time.time() - started, 2),
+            })
+        except RunCancelled:
+            pass
+        except Exception as e:
+            app.logger.error(f"Error in streamed plagiarism run: {str(e)}")
+            app.logger.error(traceback.format_exc())
+            records.put({
+                'type': 'error',
+                'error': 'Server error during plagiarism check',
+                'details': str(e),
+            })
+        finally:
+            records.put(None)
+
+    _job_executor.submit(run)
+    try:
+        while True:
+            record = records.get()
+            if record is None:
+                return
+            yield record
+    finally:
+        cancelled.set()
+
+
+def stream_records(records, fmt):
+    """Send records as newline-delimited JSON, or as Server-Sent Events
+    named after each record's type."""
+    def generate():
+        for record in records:
+            payload = app.json.dumps(record)
+            if fmt == 'sse':
+                yield f"event: {record['type']}\ndata: {payload}\n\n"
+            else:
+                yield payload + '\n'
+
+    mimetype = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+    return app.response_class(generate(), mimetype=mimetype,
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/api/run', methods=['POST'])
 def run_plagiarism_check():
     try:
-        results = compare_all_submissions(UPLOAD_FOLDER)
-        return jsonify(results), 200
+        # ?incremental=true only scores new or changed submissions
+        incremental = request.args.get('incremental', '').lower() in ('1', 'true', 'yes')
+        # ?index=true scores only fingerprint-index candidates; faster, but can miss matches
+        use_index = request.args.get('index', '').lower() in ('1', 'true', 'yes')
+
+        # ?stream=ndjson or ?stream=sse sends each match as soon as it is found
+        fmt = request.args.get('stream')
+        if fmt:
+            if fmt not in STREAM_FORMATS:
+                return jsonify({'error': f"stream must be one of: {', '.join(STREAM_FORMATS)}"}), 400
+            return stream_records(stream_plagiarism_run(UPLOAD_FOLDER, incremental, use_index), fmt)
+
+        # ?report=clusters returns clone families, paged with ?page=&per_page=;
+        # ?cluster_threshold= sets the similarity that links two submissions
+        report = request.args.get('report', 'pairs')
+        if report not in REPORT_FORMATS:
+            return jsonify({'error': f"report must be one of: {', '.join(REPORT_FORMATS)}"}), 400
+        cluster_threshold = None
+        if report == 'clusters':
+            try:
+                cluster_threshold = float(request.args.get('cluster_threshold', RUN_THRESHOLD))
+                page, per_page = _page_params()
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if cluster_threshold < RUN_THRESHOLD:
+                return jsonify({'error': f'cluster_threshold must be at least {RUN_THRESHOLD}, '
+                                         'the similarity at which matches are reported'}), 400
+
+        # ?wait=true keeps the old blocking behaviour for scripts
+        if request.args.get('wait', '').lower() in ('1', 'true', 'yes'):
+            results = compare_all_submissions(UPLOAD_FOLDER, incremental=incremental,
+                                              use_index=use_index)
+            if cluster_threshold is not None:
+                summary, clusters = cluster_results(results, cluster_threshold)
+                results = cluster_page(summary, clusters, page, per_page)
+            return jsonify(results), 200
+
+        job_id = start_plagiarism_job(UPLOAD_FOLDER, incremental, cluster_threshold, use_index)
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/api/run/{job_id}'
+        }), 202
     except Exception as e:
         app.logger.error(f"Error in run_plagiarism_check: {str(e)}")
         app.logger.error(traceback.format_exc())
         return jsonify({'error': 'Server error during plagiarism check', 'details': str(e)}), 500
 
 
+@app.route('/api/run/<job_id>', methods=['GET'])
+def get_plagiarism_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': f'Unknown job: {job_id}'}), 404
+        if job['clusters'] is not None:
+            try:
+                page, per_page = _page_params()
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            return jsonify(cluster_page(*job['clusters'], page, per_page)), 200
+        if job['response'] is not None:
+            payload, code = job['response']
+            return app.response_class(payload, status=code, mimetype='application/json')
+        body = _job_status(job)
+    return jsonify(body), 200
+
+
+def _history_params():
+    try:
+        k = int(request.args.get('k', HISTORY_TOP_K))
+        threshold = float(request.args.get('threshold', 50))
+    except ValueError:
+        raise ValueError('k and threshold must be numbers')
+    if k < 1:
+        raise ValueError('k must be at least 1')
+    return k, threshold, request.args.get('exclude_label')
+
+
+@app.route('/api/history', methods=['GET', 'POST'])
+def history():
+    """GET: index statistics. POST {"label": ...}: add the current
+    submissions to the history index under that label."""
+    try:
+        if request.method == 'GET':
+            return jsonify(open_history_index().stats()), 200
+        label = (request.get_json(silent=True) or {}).get('label') or request.args.get('label')
+        if not label:
+            return jsonify({'error': 'A label (e.g. cohort and assignment) is required'}), 400
+        return jsonify(add_to_history(UPLOAD_FOLDER, label)), 200
+    except StaleIndexError as e:
+        return jsonify({'error': str(e), 'reindex_url': '/api/history/reindex'}), 409
+    except Exception as e:
+        app.logger.error(f"Error in history: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'error': 'Server error in history index', 'details': str(e)}), 500
+
+
+@app.route('/api/history/matches', methods=['GET'])
+def history_matches():
+    """Top-k past submissions for every current submission."""
+    try:
+        k, threshold, exclude_label = _history_params()
+        index = open_history_index()
+        results = []
+        for submission in catalog.submissions(UPLOAD_FOLDER):
+            matches = query_history(submission_features(submission), k, threshold,
+                                    exclude_label, index)
+            if matches:
+                results.append({'student': submission.filename, 'matches': matches})
+        return jsonify({'results': results}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except StaleIndexError as e:
+        return jsonify({'error': str(e), 'reindex_url': '/api/history/reindex'}), 409
+    except Exception as e:
+        app.logger.error(f"Error in history_matches: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'error': 'Server error in history index', 'details': str(e)}), 500
+
+
+@app.route('/api/history/query', methods=['POST'])
+def history_query():
+    """Top-k past submissions for one uploaded file (form field "file")."""
+    try:
+        k, threshold, exclude_label = _history_params()
+        file = request.files.get('file')
+        if file is None or not file.filename:
+            return jsonify({'error': 'No file uploaded'}), 400
+        code = file.read().decode('utf-8', errors='ignore')
+        features = get_code_features(code, language_for(file.filename))
+        return jsonify({
+            'filename': file.filename,
+            'matches': query_history(features, k, threshold, exclude_label),
+        }), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except StaleIndexError as e:
+        return jsonify({'error': str(e), 'reindex_url': '/api/history/reindex'}), 409
+    except Exception as e:
+        app.logger.error(f"Error in history_query: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'error': 'Server error in history index', 'details': str(e)}), 500
+
+
+@app.route('/api/history/reindex', methods=['POST'])
+def history_reindex():
+    """Recompute stored signatures after a change to fingerprinting."""
+    try:
+        index = open_history_index()
+        count = index.reindex(lambda code, language: history_signature(
+            get_code_features(code, language)))
+        return jsonify({'reindexed': count}), 200
+    except Exception as e:
+        app.logger.error(f"Error in history_reindex: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'error': 'Server error in history index', 'details': str(e)}), 500
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'ok'}), 200
@@ -0,0 +1,2 @@
+"""Code-processing helpers shared by the plagiarism (models/app.py) and
+AI-detection (two_code/two.py) services."""
@@ -0,0 +1,104 @@
+"""Compact structural features of syntax trees.
+
+Trees are Python ast trees, or Node trees built by shared.parsers for the
+other languages, whose node kinds reuse the closest ast class names.
+
+Node types are interned to small integers, so a file's node-type stream is
+an array('H') rather than a list of class-name strings. Comparing the
+arrays gives the same SequenceMatcher ratio as comparing the names.
+
+subtree_hashes() is a more compact structural encoding. Every subtree is
+hashed from its node types and height, and only subtrees of at least
+SUBTREE_MIN_HEIGHT are kept. Two files are then compared by the overlap
+of their hash multisets. This ignores identifiers and the order of
+definitions, and costs a fraction of the node stream's memory.
+"""
+import ast
+import hashlib
+from array import array
+from collections import Counter, deque, namedtuple
+
+
+# Node kinds with no ast class, used by the other languages' parsers
+EXTRA_NODE_TYPES = ['Block']
+
+# Stable within one Python version only: new or removed ast classes shift the
+# IDs. Anything stored that was derived from them (e.g. history signatures)
+# must record NODE_TYPES_DIGEST and be rebuilt when it changes.
+NODE_TYPES = sorted(name for name, obj in vars(ast).items()
+                    if isinstance(obj, type) and issubclass(obj, ast.AST)) + EXTRA_NODE_TYPES
+NODE_IDS = {name: n + 1 for n, name in enumerate(NODE_TYPES)}
+NODE_TYPES_DIGEST = hashlib.sha1(' '.join(NODE_TYPES).encode('ascii')).hexdigest()[:12]
+
+Node = namedtuple('Node', ['kind', 'children'])
+
+# Subtrees lower than this (names, constants, contexts) are too common to
+# say anything about copying
+SUBTREE_MIN_HEIGHT = 5
+
+
+def parse(code):
+    """Python syntax tree of code, or None when it does not parse."""
+    try:
+        return ast.parse(code)
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+
+
+def walk_nodes(tree):
+    """Breadth-first walk of a Node tree, in the same order as ast.walk."""
+    todo = deque([tree])
+    while todo:
+        node = todo.popleft()
+        todo.extend(node.children)
+        yield node
+
+
+def node_type_ids(tree):
+    """Interned node types of tree in ast.walk order, as array('H')."""
+    if tree is None:
+        return array('H')
+    if isinstance(tree, Node):
+        return array('H', [NODE_IDS.get(node.kind, 0) for node in walk_nodes(tree)])
+    return array('H', [NODE_IDS.get(type(node).__name__, 0) for node in ast.walk(tree)])
+
+
+def subtree_hashes(tree, min_height=SUBTREE_MIN_HEIGHT):
+    """Sorted hashes of every subtree at least min_height high, as array('q').
+
+    A subtree's hash covers its node type, its height and its children's
+    hashes in order. Hashes of int tuples do not depend on PYTHONHASHSEED,
+    so worker processes agree on them.
+    """
+    if tree is None:
+        return array('q')
+    if isinstance(tree, Node):
+        kind_of, children_of = (lambda node: node.kind), (lambda node: node.children)
+    else:
+        kind_of, children_of = (lambda node: type(node).__name__), ast.iter_child_nodes
+    hashes = []
+
+    def visit(node):
+        children = [visit(child) for child in children_of(node)]
+        height = 1 + max((h for _, h in children), default=0)
+        value = hash((NODE_IDS.get(kind_of(node), 0), height) +
+                     tuple(v for v, _ in children))
+        if height >= min_height:
+            hashes.append(value)
+        return value, height
+
+    try:
+        visit(tree)
+    except RecursionError:
+        return array('q')
+    hashes.sort()
+    return array('q', hashes)
+
+
+def subtree_similarity(hashes1, hashes2):
+    """Dice coefficient of two subtree hash multisets, between 0 and 1."""
+    total = len(hashes1) + len(hashes2)
+    if not total:
+        return 1.0
+    common = sum((Counter(hashes1) & Counter(hashes2)).values())
+    return 2.0 * common / total
@@ -0,0 +1,176 @@
+"""In-process counters and histograms, rendered as Prometheus text.
+
+Each service keeps one Metrics registry and serves render() at
+/api/metrics. Updates take one lock and a bisect, so timing hot paths
+such as scoring one pair costs about a microsecond per observation.
+Worker processes record into their own copy of the registry. They send
+snapshot(reset=True) back to the parent, which merge()s it.
+
+instrument_app() also adds per-endpoint request counts and latencies.
+When PROFILE_REQUESTS=1 it allows a ?profile=1 cProfile capture of one
+request.
+"""
+import cProfile
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# Upper bounds in seconds; the implicit last bucket is +Inf
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', '0') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.getcwd(), 'profiles'))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metrics:
+    """A registry of named counters and histograms with optional labels."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._kinds = {}                       # name -> (kind, help, buckets)
+        self._counters = defaultdict(float)    # (name, labels) -> value
+        self._histograms = {}                  # (name, labels) -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+
+    def counter(self, name, help):
+        self._kinds[name] = ('counter', help, None)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        self._kinds[name] = ('histogram', help, tuple(buckets))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, **labels):
+        buckets = self._kinds[name][2]
+        key = (name, _labels_key(labels))
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            counts[bisect_left(buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the seconds spent in the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            snap = (dict(self._counters), {k: list(v) for k, v in self._histograms.items()})
+            if reset:
+                self._counters.clear()
+                self._histograms.clear()
+        return snap
+
+    def merge(self, snap):
+        """Add a snapshot taken in another process."""
+        counters, histograms = snap
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] += value
+            for key, counts in histograms.items():
+                mine = self._histograms.get(key)
+                if mine is None:
+                    self._histograms[key] = list(counts)
+                else:
+                    for n, value in enumerate(counts):
+                        mine[n] += value
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        counters, histograms = self.snapshot()
+        lines = []
+        for name, (kind, help, buckets) in self._kinds.items():
+            full = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full} {help}')
+            lines.append(f'# TYPE {full} {kind}')
+            if kind == 'counter':
+                for (metric, key), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{full}{_format_labels(key)} {_format_value(value)}')
+                continue
+            for (metric, key), counts in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append(f'{full}_bucket{_format_labels(key, [("le", bound)])} {cumulative}')
+                lines.append(f'{full}_sum{_format_labels(key)} {_format_value(counts[-1])}')
+                lines.append(f'{full}_count{_format_labels(key)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def instrument_app(app, metrics):
+    """Count and time every request of a Flask app by endpoint, serve
+    metrics at /api/metrics, and profile requests made with ?profile=1
+    when PROFILE_REQUESTS is on.
+
+    A profile covers the view function only, on the request thread; a
+    streamed body, background jobs and scoring processes are not in it.
+    Its .prof file is written to PROFILE_DIR and named in the
+    X-Profile-Path response header.
+    """
+    from flask import g, request
+
+    metrics.counter('http_requests_total', 'Requests by endpoint and status.')
+    metrics.histogram('http_request_seconds', 'Request latency by endpoint, up to the first byte.')
+
+    @app.before_request
+    def _start_request():
+        g.metrics_start = time.perf_counter()
+        g.profiler = None
+        if PROFILE_REQUESTS and request.args.get('profile', '').lower() in ('1', 'true', 'yes'):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def _finish_request(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f'{request.endpoint}-{time.time():.6f}.prof')
+            profiler.dump_stats(path)
+            response.headers['X-Profile-Path'] = path
+        start = g.pop('metrics_start', None)
+        endpoint = request.endpoint or 'unmatched'
+        if start is not None:
+            metrics.observe('http_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+        metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+        return response
+
+    @app.route('/api/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return app.response_class(metrics.render(), mimetype=None, content_type=CONTENT_TYPE)
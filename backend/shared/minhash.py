@@ -0,0 +1,277 @@
+"""MinHash signatures and a persistent LSH index of past submissions.
+
+A signature holds the minimum of NUM_PERM random hash permutations over
+a file's shingles. Two signatures agree in a share of positions that
+estimates the Jaccard similarity of the shingle sets. Signatures are cut
+into BANDS bands. Files sharing any whole band land in the same bucket,
+so a query only reads its own BANDS buckets instead of every stored
+file. With 32 bands of 4 rows, pairs above ~0.5 Jaccard are found with
+high probability.
+
+LSHIndex keeps signatures, buckets and compressed sources in one SQLite
+file, so candidates can be re-scored exactly after the lookup.
+"""
+import hashlib
+import random
+import sqlite3
+import time
+import zlib
+from array import array
+from collections import Counter
+from contextlib import closing
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:  # signatures are computed in pure Python without NumPy
+    np = None
+
+
+NUM_PERM = 128
+BANDS = 32
+MERSENNE = (1 << 31) - 1
+
+# Buckets holding more sources than this are boilerplate; only this many are read
+MAX_BUCKET_SOURCES = 1000
+# Sources per SQL statement, below SQLite's host parameter limit
+SQL_CHUNK = 500
+
+
+class StaleIndexError(Exception):
+    """The index was built with other signature or shingle settings."""
+
+
+@lru_cache(maxsize=8)
+def _permutations(num_perm, seed):
+    rng = random.Random(seed)
+    return tuple((rng.randrange(1, MERSENNE), rng.randrange(MERSENNE)) for _ in range(num_perm))
+
+
+def minhash(shingles, num_perm=NUM_PERM, seed=1):
+    """MinHash signature of an iterable of int shingles, as array('I').
+
+    NumPy and pure Python give the same values; an empty set gets an
+    all-MERSENNE signature.
+    """
+    values = {s % MERSENNE for s in shingles}
+    if not values:
+        return array('I', [MERSENNE] * num_perm)
+    perms = _permutations(num_perm, seed)
+    if np is not None:
+        x = np.fromiter(values, dtype=np.uint64, count=len(values))
+        a = np.array([p[0] for p in perms], dtype=np.uint64)[:, None]
+        b = np.array([p[1] for p in perms], dtype=np.uint64)[:, None]
+        # a * x < 2**62, so nothing overflows
+        return array('I', ((a * x + b) % MERSENNE).min(axis=1).tolist())
+    return array('I', [min((a * x + b) % MERSENNE for x in values) for a, b in perms])
+
+
+def estimated_similarity(sig1, sig2):
+    """Share of agreeing positions, an estimate of the Jaccard similarity."""
+    return sum(x == y for x, y in zip(sig1, sig2)) / len(sig1) if len(sig1) else 0.0
+
+
+def band_keys(signature, bands=BANDS):
+    """One signed 64-bit bucket key per band; the band number is part of the key."""
+    rows = len(signature) // bands
+    keys = []
+    for band in range(bands):
+        part = signature[band * rows:(band + 1) * rows].tobytes() + band.to_bytes(2, 'little')
+        keys.append(int.from_bytes(hashlib.blake2b(part, digest_size=8).digest(), 'little',
+                                   signed=True))
+    return keys
+
+
+def _chunks(items, size=SQL_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class LSHIndex:
+    """Persistent MinHash-LSH index of sources and the submissions using them.
+
+    A source is one distinct file content (by digest). An entry records a
+    submission (label, name) of that source, e.g. ('2023-hw2', 'alice_1_a.py').
+    config describes how shingles are made; opening an index built with
+    another config raises StaleIndexError until reindex() is run.
+    """
+
+    def __init__(self, db_path, config='', num_perm=NUM_PERM, bands=BANDS):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.db_path = db_path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.config = f'{num_perm}:{bands}:{config}'
+        with closing(self._connect()) as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sources (
+                    id INTEGER PRIMARY KEY,
+                    digest TEXT NOT NULL UNIQUE,
+                    language TEXT,
+                    signature BLOB NOT NULL,
+                    code BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS entries (
+                    label TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    source INTEGER NOT NULL,
+                    added REAL NOT NULL,
+                    PRIMARY KEY (label, name)
+                );
+                CREATE INDEX IF NOT EXISTS entries_source ON entries (source);
+                CREATE TABLE IF NOT EXISTS buckets (
+                    bucket INTEGER NOT NULL,
+                    source INTEGER NOT NULL,
+                    PRIMARY KEY (bucket, source)
+                ) WITHOUT ROWID;
+                ''')
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('config', ?)",
+                             (self.config,))
+            (stored,) = conn.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        self.stale = stored != self.config
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _check(self):
+        if self.stale:
+            raise StaleIndexError(f'{self.db_path} was built with other settings; reindex it')
+
+    def add_many(self, items):
+        """Add (label, name, digest, language, code, signature) items in one
+        transaction. Returns the number of sources that were new."""
+        self._check()
+        added = 0
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                for label, name, digest, language, code, signature in items:
+                    row = conn.execute('SELECT id FROM sources WHERE digest = ?', (digest,)).fetchone()
+                    if row is None:
+                        cur = conn.execute(
+                            'INSERT INTO sources (digest, language, signature, code) VALUES (?, ?, ?, ?)',
+                            (digest, language, signature.tobytes(),
+                             zlib.compress(code.encode('utf-8'))))
+                        source = cur.lastrowid
+                        conn.executemany('INSERT OR IGNORE INTO buckets (bucket, source) VALUES (?, ?)',
+                                         [(key, source) for key in band_keys(signature, self.bands)])
+                        added += 1
+                    else:
+                        source = row[0]
+                    old = conn.execute('SELECT source FROM entries WHERE label = ? AND name = ?',
+                                       (label, name)).fetchone()
+                    conn.execute('INSERT OR REPLACE INTO entries (label, name, source, added) '
+                                 'VALUES (?, ?, ?, ?)', (label, name, source, now))
+                    if old is not None and old[0] != source:
+                        self._drop_if_unused(conn, old[0])
+        finally:
+            conn.close()
+        return added
+
+    def _drop_if_unused(self, conn, source):
+        # A resubmitted file replaces its entry; the superseded source must
+        # not keep turning up in queries
+        if conn.execute('SELECT 1 FROM entries WHERE source = ? LIMIT 1', (source,)).fetchone():
+            return
+        (blob,) = conn.execute('SELECT signature FROM sources WHERE id = ?', (source,)).fetchone()
+        conn.executemany('DELETE FROM buckets WHERE bucket = ? AND source = ?',
+                         [(key, source) for key in band_keys(array('I', blob), self.bands)])
+        conn.execute('DELETE FROM sources WHERE id = ?', (source,))
+
+    def query(self, signature, limit, exclude_label=None):
+        """Up to limit (source id, estimated similarity) pairs sharing a
+        bucket with signature, most similar first. Sources whose only
+        entries carry exclude_label are left out."""
+        self._check()
+        with closing(self._connect()) as conn:
+            candidates = set()
+            for key in band_keys(signature, self.bands):
+                candidates.update(source for (source,) in conn.execute(
+                    'SELECT source FROM buckets WHERE bucket = ? LIMIT ?', (key, MAX_BUCKET_SOURCES)))
+            if exclude_label is not None:
+                kept = set()
+                for chunk in _chunks(candidates):
+                    kept.update(source for (source,) in conn.execute(
+                        f'SELECT DISTINCT source FROM entries WHERE label != ? AND source IN '
+                        f'({",".join("?" * len(chunk))})', [exclude_label] + chunk))
+                candidates = kept
+            scored = []
+            for chunk in _chunks(candidates):
+                for source, blob in conn.execute(
+                        f'SELECT id, signature FROM sources WHERE id IN ({",".join("?" * len(chunk))})',
+                        chunk):
+                    scored.append((source, estimated_similarity(signature, array('I', blob))))
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+    def sources(self, source_ids):
+        """{source id: (digest, language, code)} for the given ids."""
+        found = {}
+        with closing(self._connect()) as conn:
+            for chunk in _chunks(source_ids):
+                for source, digest, language, code in conn.execute(
+                        f'SELECT id, digest, language, code FROM sources WHERE id IN '
+                        f'({",".join("?" * len(chunk))})', chunk):
+                    found[source] = (digest, language, zlib.decompress(code).decode('utf-8'))
+        return found
+
+    def entries(self, source_ids, exclude_label=None):
+        """{source id: [(label, name), ...]} for the given ids."""
+        found = {}
+        with closing(self._connect()) as conn:
+            for chunk in _chunks(source_ids):
+                for source, label, name in conn.execute(
+                        f'SELECT source, label, name FROM entries WHERE source IN '
+                        f'({",".join("?" * len(chunk))}) ORDER BY label, name', chunk):
+                    if label != exclude_label:
+                        found.setdefault(source, []).append((label, name))
+        return found
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            sources = conn.execute('SELECT COUNT(*) FROM sources').fetchone()[0]
+            labels = Counter(dict(conn.execute('SELECT label, COUNT(*) FROM entries GROUP BY label')))
+        return {
+            'sources': sources,
+            'entries': sum(labels.values()),
+            'labels': dict(labels),
+            'num_perm': self.num_perm,
+            'bands': self.bands,
+            'stale': self.stale,
+        }
+
+    def reindex(self, signature_of):
+        """Recompute every signature and bucket with signature_of(code,
+        language) and adopt this index's config."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM buckets')
+                # Sources left behind by resubmissions before they were dropped
+                conn.execute('DELETE FROM sources WHERE id NOT IN (SELECT source FROM entries)')
+            ids = [source for (source,) in conn.execute('SELECT id FROM sources ORDER BY id')]
+            for chunk in _chunks(ids):
+                with conn:
+                    rows = conn.execute(
+                        f'SELECT id, language, code FROM sources WHERE id IN ({",".join("?" * len(chunk))})',
+                        chunk).fetchall()
+                    for source, language, code in rows:
+                        signature = signature_of(zlib.decompress(code).decode('utf-8'), language)
+                        conn.execute('UPDATE sources SET signature = ? WHERE id = ?',
+                                     (signature.tobytes(), source))
+                        conn.executemany('INSERT OR IGNORE INTO buckets (bucket, source) VALUES (?, ?)',
+                                         [(key, source) for key in band_keys(signature, self.bands)])
+            with conn:
+                conn.execute("UPDATE meta SET value = ? WHERE key = 'config'", (self.config,))
+        finally:
+            conn.close()
+        self.stale = False
+        return len(ids)
@@ -0,0 +1,542 @@
+"""Pluggable structural parsers, one per submission language.
+
+parse_structure() returns a Python ast tree for Python and a Node tree
+(see shared.ast_features) for C, C++, Java, JavaScript, Go and Rust. The
+brace languages share a small error-tolerant recursive-descent parser
+over shared.tokenizer tokens. It never raises on odd input; it recovers
+at the next token. Its node kinds reuse the closest ast class names (If,
+For, Call, Assign, FunctionDef, ...), so structural streams look alike
+across languages. Another backend, e.g. a tree-sitter grammar, can
+replace one with register_parser().
+"""
+from array import array
+from functools import lru_cache, partial
+
+from .ast_features import Node, node_type_ids, parse as parse_python, subtree_hashes
+from .tokenizer import guess_language, lex
+
+
+STRUCTURE_CACHE_SIZE = 256
+
+# Type names and modifiers dropped in front of declarations
+_TYPE_WORDS = frozenset('''
+    int char float double void long short signed unsigned const static extern register
+    volatile auto inline restrict _Bool bool boolean byte final public private protected
+    abstract native synchronized transient strictfp virtual explicit mutable constexpr
+    typename let var mut pub unsafe async export defer go dyn ref move
+'''.split())
+_CLASS_WORDS = frozenset('class struct union enum interface trait impl namespace record type'.split())
+_FUNCTION_WORDS = frozenset('function func fn'.split())
+_IMPORT_WORDS = frozenset('import package using use mod'.split())
+_CONSTANT_WORDS = frozenset('true false null nullptr nil undefined'.split())
+_SELF_WORDS = frozenset('this self Self super'.split())
+_STATEMENT_WORDS = frozenset('''
+    if else while do for loop switch match case default return yield break continue
+    throw try
+'''.split()) | _CLASS_WORDS | _FUNCTION_WORDS | _IMPORT_WORDS
+
+# Binary operator -> (precedence, node kind); assignments bind right to left
+_BINARY = {}
+for _prec, _kind, _ops in [
+    (1, 'Assign', '= :='),
+    (1, 'AugAssign', '+= -= *= /= %= &= |= ^= <<= >>= >>>= **= //='),
+    (1, 'Lambda', '=>'),
+    (3, 'BoolOp', '|| ??'),
+    (4, 'BoolOp', '&&'),
+    (5, 'BinOp', '|'),
+    (6, 'BinOp', '^'),
+    (7, 'BinOp', '&'),
+    (8, 'Compare', '== != === !=='),
+    (9, 'Compare', '< > <= >= instanceof in'),
+    (10, 'BinOp', '<< >> >>> ..'),
+    (11, 'BinOp', '+ -'),
+    (12, 'BinOp', '* / % **'),
+]:
+    for _op in _ops.split():
+        _BINARY[_op] = (_prec, _kind)
+_RIGHT_ASSOC = {'Assign', 'AugAssign', 'Lambda'}
+_PREFIX_OPS = frozenset('! ~ - + ++ -- * & ...'.split())
+_GENERIC_TOKENS = frozenset(', . :: ? [ ] & * < > >>'.split())
+
+
+class _BraceParser:
+
+    def __init__(self, tokens):
+        self.tokens = [tok for tok in tokens if tok.kind != 'comment']
+        self.pos = 0
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else None
+
+    def at(self, *texts):
+        tok = self.peek()
+        return tok is not None and tok.kind in ('op', 'keyword') and tok.text in texts
+
+    def at_word(self, words):
+        tok = self.peek()
+        return tok is not None and tok.kind == 'keyword' and tok.text in words
+
+    def advance(self):
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    # Statements
+
+    def module(self):
+        return Node('Module', self.statements(in_block=False))
+
+    def statements(self, in_block):
+        body = []
+        while self.peek() is not None:
+            if self.at('}'):
+                if in_block:
+                    break
+                self.advance()
+                continue
+            start = self.pos
+            stmt = self.statement()
+            if stmt is not None:
+                body.append(stmt)
+            if self.pos == start:
+                self.advance()
+        return body
+
+    def block(self):
+        if self.peek() is None:
+            return Node('Block', [])
+        if not self.at('{'):
+            stmt = self.statement()
+            return stmt if stmt is not None else Node('Block', [])
+        self.advance()
+        body = self.statements(in_block=True)
+        if self.at('}'):
+            self.advance()
+        return Node('Block', body)
+
+    def statement(self):
+        tok = self.peek()
+        if tok.kind == 'op':
+            if tok.text == ';':
+                self.advance()
+                return None
+            if tok.text == '{':
+                return self.block()
+            if tok.text == '#':
+                return self.directive()
+            if tok.text == '@':
+                # Annotations and decorators
+                self.advance()
+                self.advance()
+                if self.at('('):
+                    self.advance()
+                    self.arguments(')')
+                return None
+        elif tok.kind == 'keyword' and tok.text in _STATEMENT_WORDS:
+            return self.keyword_statement(tok.text)
+        return self.expression_statement()
+
+    def keyword_statement(self, word):
+        self.advance()
+        if word == 'if':
+            node = [self.expression(), self.block()]
+            if self.at_word({'else'}):
+                self.advance()
+                node.append(self.block())
+            return Node('If', [child for child in node if child is not None])
+        if word == 'else':
+            return self.block()
+        if word == 'while':
+            return Node('While', self.present(self.expression(), self.block()))
+        if word == 'do':
+            body = self.block()
+            cond = None
+            if self.at_word({'while'}):
+                self.advance()
+                cond = self.expression()
+            self.skip(';')
+            return Node('While', self.present(cond, body))
+        if word == 'loop':
+            return Node('While', [self.block()])
+        if word == 'for':
+            return Node('For', self.for_header() + [self.block()])
+        if word in ('switch', 'match'):
+            return Node('Match', self.present(self.expression(), self.block()))
+        if word == 'default' and not self.at(':', '=>'):
+            return None  # export default ...
+        if word in ('case', 'default'):
+            value = None if self.at(':', '=>') else self.expression(allow_comma=False)
+            if self.at(':', '=>'):
+                self.advance()
+            return Node('match_case', self.present(value))
+        if word in ('return', 'yield'):
+            value = None if self.at(';', '}') else self.expression()
+            self.skip(';')
+            return Node('Return', self.present(value))
+        if word in ('break', 'continue'):
+            tok = self.peek()
+            if tok is not None and tok.kind == 'name':
+                self.advance()  # loop label
+            self.skip(';')
+            return Node('Break' if word == 'break' else 'Continue', [])
+        if word == 'throw':
+            value = self.expression()
+            self.skip(';')
+            return Node('Raise', self.present(value))
+        if word == 'try':
+            children = [self.block()]
+            while self.at_word({'catch'}):
+                self.advance()
+                if self.at('('):
+                    self.advance()
+                    self.arguments(')')
+                children.append(Node('ExceptHandler', [self.block()]))
+            if self.at_word({'finally'}):
+                self.advance()
+                children.append(self.block())
+            return Node('Try', children)
+        if word in _CLASS_WORDS:
+            return self.class_statement()
+        if word in _FUNCTION_WORDS:
+            return self.function()
+        # Imports run to the end of the line, or of a Go import group
+        line = self.tokens[self.pos - 1].line
+        depth = 0
+        while self.peek() is not None and (depth or self.peek().line == line) and not self.at(';'):
+            tok = self.advance()
+            if tok.text == '(':
+                depth += 1
+            elif tok.text == ')':
+                depth -= 1
+        self.skip(';')
+        return Node('Import', [])
+
+    def class_statement(self):
+        while self.peek() is not None and not self.at('{', ';', '=', '(', '}'):
+            self.advance()
+        if self.at('{'):
+            return Node('ClassDef', self.block().children)
+        if self.at('='):
+            # A declaration using the type, e.g. struct point p = {1, 2};
+            self.advance()
+            value = self.expression()
+            self.skip(';')
+            return Node('Assign', self.present(Node('Name', []), value))
+        if self.at('('):
+            # A function returning the type
+            self.advance()
+            args = self.arguments(')')
+            if self.function_body_follows():
+                return self.function_body(args)
+        self.skip(';')
+        return None
+
+    def function(self):
+        """Rest of a fn/func/function definition, after the keyword."""
+        args = []
+        while self.peek() is not None and not self.at('{', ';', '}'):
+            if self.at('('):
+                self.advance()
+                args.extend(self.arguments(')'))
+            else:
+                self.advance()
+        if not self.at('{'):
+            self.skip(';')
+            return Node('FunctionDef', args)
+        return Node('FunctionDef', args + [self.block()])
+
+    def function_body(self, args):
+        while not self.at('{'):
+            self.advance()
+        return Node('FunctionDef', args + [self.block()])
+
+    def function_body_follows(self):
+        # Qualifiers may sit between the parameters and the body:
+        # "const", "throws X", "-> T", ": base(x)"
+        for offset in range(24):
+            tok = self.peek(offset)
+            if tok is None or tok.text in (';', '}', '='):
+                return False
+            if tok.kind == 'keyword' and tok.text in _STATEMENT_WORDS:
+                return False
+            if tok.text == '{' and tok.kind == 'op':
+                return True
+        return False
+
+    def expression_statement(self):
+        self.skip_declaration_prefix()
+        if self.at_word(_STATEMENT_WORDS):
+            return self.statement()  # public class, export function, ...
+        expr = self.expression()
+        if expr is None:
+            return None
+        if expr.kind == 'Call' and self.function_body_follows():
+            return self.function_body(expr.children[1:])
+        if expr.kind == 'Name' and self.at(':'):
+            # Type annotation, e.g. let x: i32 = 5
+            while self.peek() is not None and not self.at('=', ';', '{', '}'):
+                self.advance()
+            if self.at('='):
+                self.advance()
+                expr = Node('Assign', self.present(expr, self.expression()))
+        self.skip(';')
+        if expr.kind in ('Assign', 'AugAssign'):
+            return expr
+        return Node('Expr', [expr])
+
+    def for_header(self):
+        paren = self.at('(')
+        if paren:
+            self.advance()
+        end = ')' if paren else '{'
+        parts = []
+        while self.peek() is not None and not self.at(end, '}'):
+            start = self.pos
+            self.skip_declaration_prefix()
+            expr = self.expression()
+            if expr is not None:
+                parts.append(expr)
+            if self.at(';', ':'):
+                self.advance()
+            elif self.pos == start:
+                self.advance()
+        if paren:
+            self.skip(')')
+        return parts
+
+    def directive(self):
+        line = self.advance().line
+        word = self.peek()
+        node = None
+        if word is not None and word.line == line and word.text in ('include', 'import'):
+            node = Node('Import', [])
+        while self.peek() is not None and self.peek().line == line:
+            if self.advance().text == '\\':
+                line += 1
+        return node
+
+    def skip(self, text):
+        if self.at(text):
+            self.advance()
+
+    def skip_declaration_prefix(self):
+        while True:
+            tok, nxt = self.peek(), self.peek(1)
+            if tok is None:
+                return
+            if tok.kind == 'keyword' and tok.text in _TYPE_WORDS:
+                self.advance()
+            elif tok.text == '[' and nxt is not None and nxt.text == ']':
+                self.advance()
+                self.advance()
+            elif tok.kind == 'name' and nxt is not None and nxt.line == tok.line:
+                end = self.generic_end(self.pos + 1) if nxt.text == '<' else None
+                if end is not None and self.starts_name(end, tok.line):
+                    self.pos = end
+                elif nxt.kind == 'name' or (nxt.text in ('*', '&') and self.starts_name(self.pos + 2, tok.line)):
+                    self.advance()
+                elif nxt.text == '[' and self.array_type_end(self.pos + 1) is not None:
+                    self.pos = self.array_type_end(self.pos + 1)
+                else:
+                    return
+            else:
+                return
+
+    def starts_name(self, index, line):
+        tok = self.tokens[index] if index < len(self.tokens) else None
+        return tok is not None and tok.kind == 'name' and tok.line == line
+
+    def array_type_end(self, index):
+        """Index of the name after the [] pairs starting at index, if any."""
+        line = self.tokens[index].line
+        while index + 1 < len(self.tokens) and self.tokens[index].text == '[' and \
+                self.tokens[index + 1].text == ']':
+            index += 2
+        return index if self.starts_name(index, line) else None
+
+    def generic_end(self, index):
+        """Index after the type arguments starting with '<' at index, if they
+        close on the same line and hold only type-like tokens."""
+        line = self.tokens[index].line
+        depth = 0
+        while index < len(self.tokens):
+            tok = self.tokens[index]
+            if tok.line != line or (tok.kind not in ('name', 'keyword') and tok.text not in _GENERIC_TOKENS):
+                return None
+            if tok.text == '<':
+                depth += 1
+            elif tok.text in ('>', '>>'):
+                depth -= len(tok.text)
+                if depth <= 0:
+                    return index + 1 if depth == 0 else None
+            index += 1
+        return None
+
+    # Expressions
+
+    @staticmethod
+    def present(*children):
+        return [child for child in children if child is not None]
+
+    def expression(self, min_prec=0, allow_comma=True):
+        left = self.unary()
+        if left is None:
+            return None
+        while True:
+            tok = self.peek()
+            if tok is None or tok.kind in ('name', 'number', 'string'):
+                return left
+            text = tok.text
+            if text == ',':
+                if not allow_comma or min_prec > 0:
+                    return left
+                self.advance()
+                left = Node('Tuple', self.present(left, self.expression(1, allow_comma=False)))
+                continue
+            if text == '?' and min_prec <= 2:
+                self.advance()
+                body = self.expression(allow_comma=False)
+                orelse = None
+                if self.at(':'):
+                    self.advance()
+                    orelse = self.expression(2, allow_comma=False)
+                left = Node('IfExp', self.present(left, body, orelse))
+                continue
+            if tok.kind == 'keyword' and text not in ('in', 'instanceof'):
+                return left
+            prec, kind = _BINARY.get(text, (None, None))
+            if prec is None or prec < min_prec:
+                return left
+            self.advance()
+            right = self.expression(prec if kind in _RIGHT_ASSOC else prec + 1, allow_comma=False)
+            left = Node(kind, self.present(left, right))
+
+    def unary(self):
+        tok = self.peek()
+        if tok is None:
+            return None
+        if tok.kind == 'op' and tok.text in _PREFIX_OPS:
+            self.advance()
+            return Node('UnaryOp', self.present(self.unary()))
+        return self.postfix(self.primary())
+
+    def postfix(self, node):
+        while node is not None:
+            if self.at('('):
+                self.advance()
+                node = Node('Call', [node] + self.arguments(')'))
+            elif self.at('['):
+                self.advance()
+                node = Node('Subscript', [node] + self.arguments(']'))
+            elif self.at('.', '->', '::', '?.'):
+                self.advance()
+                if self.peek() is not None and self.peek().kind in ('name', 'keyword'):
+                    self.advance()
+                node = Node('Attribute', [node])
+            elif self.at('++', '--'):
+                self.advance()
+                node = Node('AugAssign', [node])
+            elif self.at('!') and self.peek(1) is not None and self.peek(1).text in ('(', '['):
+                self.advance()  # Rust macro call, e.g. println!(...)
+            elif self.at('<') and self.generic_end(self.pos) is not None and \
+                    self.peek(self.generic_end(self.pos) - self.pos) is not None and \
+                    self.peek(self.generic_end(self.pos) - self.pos).text in ('(', '::'):
+                self.pos = self.generic_end(self.pos)  # new ArrayList<>()
+            else:
+                return node
+        return node
+
+    def primary(self):
+        tok = self.advance()
+        if tok is None:
+            return None
+        kind, text = tok.kind, tok.text
+        if kind == 'name':
+            return Node('Name', [])
+        if kind in ('number', 'string'):
+            return Node('Constant', [])
+        if kind == 'keyword':
+            if text in _CONSTANT_WORDS:
+                return Node('Constant', [])
+            if text in _SELF_WORDS:
+                return Node('Name', [])
+            if text == 'new':
+                node = self.unary()
+                return node if node is not None and node.kind == 'Call' else Node('Call', self.present(node))
+            if text in _FUNCTION_WORDS:
+                return Node('Lambda', self.function().children)
+            if text in _STATEMENT_WORDS:
+                self.pos -= 1
+                return self.statement()
+            if text in _TYPE_WORDS:
+                return self.unary()
+            return Node('UnaryOp', self.present(self.unary()))
+        if text == '(':
+            items = self.arguments(')')
+            nxt = self.peek()
+            if not items and nxt is not None and nxt.line == tok.line and nxt.kind in ('name', 'number', 'string'):
+                return self.unary()  # cast, e.g. (int) x
+            return items[0] if len(items) == 1 else Node('Tuple', items)
+        if text == '[':
+            return Node('List', self.arguments(']'))
+        if text == '{':
+            self.pos -= 1
+            return self.block()
+        return None
+
+    def arguments(self, close):
+        """Comma-separated expressions up to and including close."""
+        args = []
+        while self.peek() is not None and not self.at(close, ';', '}'):
+            start = self.pos
+            self.skip_declaration_prefix()
+            if self.at(close):
+                break
+            arg = self.expression(allow_comma=False)
+            if arg is not None:
+                args.append(arg)
+            if self.at(','):
+                self.advance()
+            elif self.pos == start:
+                self.advance()
+        self.skip(close)
+        return args
+
+
+def parse_braces(code, language='c'):
+    """Node tree of a C-family, Java, JavaScript, Go or Rust source."""
+    return _BraceParser(lex(code, language)).module()
+
+
+PARSERS = {}
+
+
+def register_parser(language, parser):
+    """Use parser(code) -> tree or None for a language."""
+    PARSERS[language] = parser
+
+
+register_parser('python', parse_python)
+for _language in ('c', 'cpp', 'java', 'js', 'go', 'rs'):
+    register_parser(_language, partial(parse_braces, language=_language))
+
+
+def parse_structure(code, language=None):
+    """Syntax tree of code for language (guessed when None), or None when
+    the language has no parser or the code cannot be parsed."""
+    parser = PARSERS.get(language or guess_language(code))
+    if parser is None:
+        return None
+    try:
+        return parser(code)
+    except RecursionError:
+        return None
+
+
+@lru_cache(maxsize=STRUCTURE_CACHE_SIZE)
+def structure_features(code, language=None, subtrees=False):
+    """Cached (node type IDs, subtree hashes) of code; the subtree hashes
+    are only computed when asked for. The arrays must not be modified."""
+    tree = parse_structure(code, language)
+    return node_type_ids(tree), subtree_hashes(tree) if subtrees else array('q')
@@ -0,0 +1,23 @@
+"""Which files of a submissions folder take part in comparisons.
+
+The plagiarism service's catalog and the detector's folder=uploads
+comparison both use this rule, so they see the same set of files: any
+UTF-8 text file, whatever its extension, except partial uploads and
+hidden files.
+"""
+
+# Partial uploads (temp_) and hidden files
+IGNORED_PREFIXES = ('temp_', '.')
+
+
+def is_text(data):
+    """True for bytes that decode as UTF-8 and hold no NUL byte."""
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError:
+        return False
+    return b'\0' not in data
+
+
+def is_submission(filename, data):
+    return not filename.startswith(IGNORED_PREFIXES) and is_text(data)
@@ -0,0 +1,226 @@
+"""Lexical tokenizer for the supported submission languages.
+
+Python is lexed with the tokenize module; C, C++, Java, JavaScript, Go and
+Rust share a regex lexer that knows each language's comment, string and
+keyword rules. Tokens can be turned into compact uint16 ID arrays in which
+every identifier, number and string literal is collapsed to one ID, so
+renaming variables or changing constants does not change the stream.
+"""
+import ast
+import hashlib
+import io
+import keyword
+import re
+import tokenize
+import zlib
+from array import array
+from collections import namedtuple
+
+
+Token = namedtuple('Token', ['kind', 'text', 'line', 'col'])
+
+# File extension -> language name
+LANGUAGES = {
+    'py': 'python', 'c': 'c', 'h': 'c', 'cpp': 'cpp', 'cc': 'cpp', 'hpp': 'cpp',
+    'java': 'java', 'js': 'js', 'go': 'go', 'rs': 'rs',
+}
+
+KEYWORDS = {
+    'python': frozenset(keyword.kwlist),
+    'c': frozenset('''
+        auto break case char const continue default do double else enum extern float
+        for goto if inline int long register restrict return short signed sizeof static
+        struct switch typedef union unsigned void volatile while _Bool
+    '''.split()),
+    'java': frozenset('''
+        abstract assert boolean break byte case catch char class const continue default
+        do double else enum extends final finally float for goto if implements import
+        instanceof int interface long native new package private protected public return
+        short static strictfp super switch synchronized this throw throws transient try
+        void volatile while var record yield true false null
+    '''.split()),
+    'js': frozenset('''
+        async await break case catch class const continue debugger default delete do
+        else export extends false finally for function if import in instanceof let new
+        null of return super switch this throw true try typeof undefined var void while
+        with yield
+    '''.split()),
+    'go': frozenset('''
+        break case chan const continue default defer else fallthrough false for func go
+        goto if import interface map nil package range return select struct switch true
+        type var
+    '''.split()),
+    'rs': frozenset('''
+        as async await break const continue crate dyn else enum extern false fn for if
+        impl in let loop match mod move mut pub ref return self Self static struct super
+        trait true type unsafe use where while
+    '''.split()),
+}
+KEYWORDS['cpp'] = KEYWORDS['c'] | frozenset('''
+    bool catch class constexpr const_cast decltype delete dynamic_cast explicit false
+    final friend mutable namespace new noexcept nullptr operator override private
+    protected public reinterpret_cast static_cast template this throw true try typeid
+    typename using virtual
+'''.split())
+
+OPERATORS = '''
+    ... >>>= === !== >>> <<= >>= **= //= ->* :: -> => := ++ -- && || == != <= >= += -= *= /= %= &= |=
+    ^= << >> ** // .. ?? ?. + - * / % & | ^ ~ ! = < > ? : ; , . ( ) [ ] { } @ # $ \\
+'''.split()
+
+# Token IDs: normalized kinds first, then keywords and operators in a fixed
+# order, then a hashed range for anything else. IDs are stable across runs,
+# but Python's keyword list differs between versions; whatever stores them
+# should record VOCAB_DIGEST.
+IDENT, NUMBER, STRING, INDENT, DEDENT = 1, 2, 3, 4, 5
+_VOCAB = {text: 16 + n for n, text in enumerate(sorted(
+    set(OPERATORS).union(*KEYWORDS.values())))}
+VOCAB_DIGEST = hashlib.sha1(' '.join(sorted(_VOCAB, key=_VOCAB.get)).encode('utf-8')).hexdigest()[:12]
+_HASHED_BASE = 16 + len(_VOCAB)
+_HASHED_SIZE = 4096
+
+
+def _lexer(line_comment, strings):
+    return re.compile('|'.join([
+        r'(?P<ws>\s+)',
+        r'(?P<comment>%s[^\n]*|/\*.*?(?:\*/|\Z))' % line_comment,
+        r'(?P<string>%s)' % '|'.join(strings),
+        r'(?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)',
+        r'(?P<name>[^\W\d]\w*)',
+        r'(?P<op>%s|\S)' % '|'.join(re.escape(op) for op in sorted(OPERATORS, key=len, reverse=True)),
+    ]), re.S)
+
+_DOUBLE = r'"(?:\\.|[^"\\\n])*"?'
+_SINGLE = r"'(?:\\.|[^'\\\n])*'?"
+_CHAR = r"'(?:\\.|[^'\\\n])'"
+_BACKTICK = r'`(?:\\.|[^`\\])*`?'
+_RAW_RUST = r'b?r(?P<hashes>#*)".*?"(?P=hashes)'
+
+_LEXERS = {
+    'c': _lexer('//', [_DOUBLE, _CHAR]),
+    'java': _lexer('//', [r'"""(?:\\.|.)*?"""', _DOUBLE, _CHAR]),
+    'js': _lexer('//', [_DOUBLE, _SINGLE, _BACKTICK]),
+    'go': _lexer('//', [_DOUBLE, _CHAR, _BACKTICK]),
+    'rs': _lexer('//', [_RAW_RUST, r'b?' + _DOUBLE, r'b?' + _CHAR]),
+    # Only used when tokenize rejects the source
+    'python': _lexer('#', [r'[rbfuRBFU]{0,2}(?:"""(?:\\.|.)*?"""' + r"|'''(?:\\.|.)*?''')",
+                           _DOUBLE, _SINGLE]),
+}
+_LEXERS['cpp'] = _LEXERS['c']
+
+_C_LINE = re.compile(r'[;{}]\s*$|^\s*#\s*include\b', re.M)
+
+
+def language_for(filename):
+    """Language name for a file name, or None for unknown extensions."""
+    if not filename or '.' not in filename:
+        return None
+    return LANGUAGES.get(filename.rsplit('.', 1)[1].lower())
+
+
+def guess_language(code):
+    """Tell Python from the brace languages when the file name does not."""
+    try:
+        compile(code, '<submission>', 'exec', ast.PyCF_ONLY_AST)
+        return 'python'
+    except (SyntaxError, ValueError):
+        pass
+    return 'c' if len(_C_LINE.findall(code)) > code.count('\n') // 10 else 'python'
+
+
+def _lex_python(code):
+    tokens = []
+    in_fstring = 0
+    for tok in tokenize.generate_tokens(io.StringIO(code).readline):
+        name = tokenize.tok_name[tok.type]
+        line, col = tok.start
+        # f-strings are split into parts on Python 3.12+; keep one STRING
+        if name == 'FSTRING_START':
+            if not in_fstring:
+                tokens.append(Token('string', tok.string, line, col))
+            in_fstring += 1
+        elif name == 'FSTRING_END':
+            in_fstring -= 1
+        elif in_fstring:
+            continue
+        elif name == 'NAME':
+            kind = 'keyword' if keyword.iskeyword(tok.string) else 'name'
+            tokens.append(Token(kind, tok.string, line, col))
+        elif name in ('NUMBER', 'STRING', 'OP', 'COMMENT', 'INDENT', 'DEDENT'):
+            tokens.append(Token(name.lower(), tok.string, line, col))
+        elif name == 'ERRORTOKEN' and not tok.string.isspace():
+            tokens.append(Token('op', tok.string, line, col))
+    return tokens
+
+
+def _lex_regex(code, language):
+    keywords = KEYWORDS[language]
+    tokens = []
+    line, line_start = 1, 0
+    for match in _LEXERS[language].finditer(code):
+        kind, text = match.lastgroup, match.group()
+        if kind != 'ws':
+            if kind == 'name' and text in keywords:
+                kind = 'keyword'
+            tokens.append(Token(kind, text, line, match.start() - line_start))
+        newlines = text.count('\n')
+        if newlines:
+            line += newlines
+            line_start = match.start() + text.rindex('\n') + 1
+    return tokens
+
+
+def lex(code, language=None):
+    """Tokens of code, comments included, with 1-based lines and 0-based
+    columns. language is a LANGUAGES value; it is guessed when None."""
+    language = language or guess_language(code)
+    if language == 'python':
+        try:
+            return _lex_python(code)
+        except (tokenize.TokenError, SyntaxError):
+            pass
+    return _lex_regex(code, language)
+
+
+def _token_id(token):
+    if token.kind == 'name':
+        return IDENT
+    if token.kind == 'number':
+        return NUMBER
+    if token.kind == 'string':
+        return STRING
+    if token.kind == 'indent':
+        return INDENT
+    if token.kind == 'dedent':
+        return DEDENT
+    token_id = _VOCAB.get(token.text)
+    if token_id is None:
+        token_id = _HASHED_BASE + zlib.crc32(token.text.encode('utf-8')) % _HASHED_SIZE
+    return token_id
+
+
+def token_ids(code, language=None):
+    """Normalized uint16 token IDs of code, without comments."""
+    return array('H', [_token_id(token) for token in lex(code, language)
+                       if token.kind != 'comment'])
+
+
+def strip_comments(code, language=None):
+    """code with its comments removed; '#' or '//' inside strings is kept."""
+    tokens = [token for token in lex(code, language) if token.kind == 'comment']
+    if not tokens:
+        return code
+    # Token lines are counted in '\n' only, unlike str.splitlines()
+    offsets = [0]
+    for text in code.split('\n'):
+        offsets.append(offsets[-1] + len(text) + 1)
+    parts = []
+    pos = 0
+    for token in tokens:
+        start = offsets[token.line - 1] + token.col
+        parts.append(code[pos:start])
+        # Keep the line breaks of block comments so line numbers stay put
+        parts.append('\n' * token.text.count('\n'))
+        pos = start + len(token.text)
+    parts.append(code[pos:])
+    return ''.join(parts)
@@ -1,14 +1,29 @@
-from flask import Flask, request, jsonify
-import ast
+from flask import Flask, request, jsonify, stream_with_context
 from difflib import SequenceMatcher
 from werkzeug.utils import secure_filename
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
-import torch
 import re
 import os
+import sys
 import tempfile
+import copy
 import zipfile
-import shutil
+import hashlib
+import sqlite3
+import threading
+import multiprocessing
+import queue
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from bisect import bisect_right
+from collections import defaultdict, namedtuple, OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared.metrics import Metrics, instrument_app
+from shared.parsers import structure_features
+from shared.submissions import is_submission
+from shared.tokenizer import language_for, strip_comments, token_ids
 
 
 app = Flask(__name__)
@@ -18,65 +33,303 @@ from flask_cors import CORS
 app = Flask(__name__)
 CORS(app)
 
+# Served at /api/metrics in the Prometheus text format
+METRICS = Metrics('detector')
+METRICS.histogram('stage_seconds', 'Time per stage: preprocess, tokenize, forward, '
+                  'ast_similarity, token_similarity, copy_regions.')
+METRICS.histogram('inference_batch_texts', 'Texts per forward pass.',
+                  buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+METRICS.counter('cache_lookups_total', 'Detection cache lookups by result.')
+METRICS.counter('windows_total', 'Token windows sent to the model.')
+instrument_app(app, METRICS)
 
-def get_ast_node_types(code_text):
-    try:
-        tree = ast.parse(code_text)
-        return [type(node).__name__ for node in ast.walk(tree)]
-    except:
-        return []
 
-def get_token_stream(code_text):
-    return code_text.replace('\n', '').replace('\t', '').replace(' ', '')
+def get_ast_node_types(code_text, language=None):
+    return structure_features(code_text, language)[0]
+
+def get_token_stream(code_text, language=None):
+    return token_ids(code_text, language)
 
-def compare_ast_similarity(code1, code2):
-    nodes1 = get_ast_node_types(code1)
-    nodes2 = get_ast_node_types(code2)
+def compare_ast_similarity(code1, code2, language1=None, language2=None):
+    nodes1 = get_ast_node_types(code1, language1)
+    nodes2 = get_ast_node_types(code2, language2)
     return SequenceMatcher(None, nodes1, nodes2).ratio() * 100
 
-def compare_token_similarity(code1, code2):
-    tokens1 = get_token_stream(code1)
-    tokens2 = get_token_stream(code2)
+def compare_token_similarity(code1, code2, language1=None, language2=None):
+    tokens1 = get_token_stream(code1, language1)
+    tokens2 = get_token_stream(code2, language2)
     return SequenceMatcher(None, tokens1, tokens2).ratio() * 100
 
-def get_matching_blocks(code1, code2):
-    sm = SequenceMatcher(None, code1, code2)
-    return sm.get_matching_blocks()
+# Copied regions are common substrings of at least COPY_MIN_LENGTH characters.
+# Seeds of that length occurring more than COPY_MAX_SEED_OCCURRENCES times in
+# the second file (blank runs, repeated boilerplate) are not used to start one.
+COPY_MIN_LENGTH = 21
+COPY_MAX_SEED_OCCURRENCES = 32
+
+def find_copied_regions(code1, code2, min_length=COPY_MIN_LENGTH):
+    """Find the maximal common substrings of code1 and code2 of at least
+    min_length characters, as (start1, start2, length) sorted by start1.
+
+    Every min_length-character substring of code2 is indexed by hash; each
+    hit from code1 is extended both ways along its diagonal, and later hits
+    inside an extended region are skipped, so the work stays close to linear.
+    Unlike SequenceMatcher this also finds regions copied out of order.
+    """
+    if len(code1) < min_length or len(code2) < min_length:
+        return []
 
-def combined_similarity(code1, code2):
-    ast_score = compare_ast_similarity(code1, code2)
-    token_score = compare_token_similarity(code1, code2)
+    seeds = defaultdict(list)
+    for j in range(len(code2) - min_length + 1):
+        seeds[code2[j:j + min_length]].append(j)
+
+    regions = []
+    covered = {}  # diagonal i - j -> end in code1 of the last region on it
+    for i in range(len(code1) - min_length + 1):
+        starts = seeds.get(code1[i:i + min_length])
+        if not starts or len(starts) > COPY_MAX_SEED_OCCURRENCES:
+            continue
+        for j in starts:
+            if covered.get(i - j, -1) > i:
+                continue
+            start1, start2 = i, j
+            while start1 > 0 and start2 > 0 and code1[start1 - 1] == code2[start2 - 1]:
+                start1 -= 1
+                start2 -= 1
+            end1, end2 = i + min_length, j + min_length
+            while end1 < len(code1) and end2 < len(code2) and code1[end1] == code2[end2]:
+                end1 += 1
+                end2 += 1
+            covered[i - j] = end1
+            regions.append((start1, start2, end1 - start1))
+    regions.sort(key=lambda region: (region[0], -region[2], region[1]))
+    return regions
+
+def distinct_regions(regions, min_length=COPY_MIN_LENGTH):
+    """Keep regions longest first while each adds at least min_length
+    characters of code1 not covered by a longer one, in code1 order."""
+    covered = bytearray(max((i + size for i, _, size in regions), default=0))
+    kept = []
+    for i, j, size in sorted(regions, key=lambda region: -region[2]):
+        if size - sum(covered[i:i + size]) >= min_length:
+            covered[i:i + size] = b'\x01' * size
+            kept.append((i, j, size))
+    kept.sort()
+    return kept
+
+def _line_starts(text):
+    starts = [0]
+    for match in re.finditer('\n', text):
+        starts.append(match.end())
+    return starts
+
+def _span(line_starts, start, length):
+    """1-based line/column of the first and last character of a region."""
+    spans = {}
+    for key, offset in (("start", start), ("end", start + length - 1)):
+        line = bisect_right(line_starts, offset)
+        spans[key + "_line"] = line
+        spans[key + "_col"] = offset - line_starts[line - 1] + 1
+    return spans
+
+def combined_similarity(code1, code2, language1=None, language2=None):
+    """Languages are guessed from the code when not given."""
+    with METRICS.timer('stage_seconds', stage='ast_similarity'):
+        ast_score = compare_ast_similarity(code1, code2, language1, language2)
+    with METRICS.timer('stage_seconds', stage='token_similarity'):
+        token_score = compare_token_similarity(code1, code2, language1, language2)
     avg_score = round((ast_score + token_score) / 2, 2)
-
-    matches = get_matching_blocks(code1, code2)
-    copied_parts = []
-    for match in matches:
-        i, j, size = match
-        if size > 20:
-            part = code1[i:i+size]
-            copied_parts.append(part)
+    copied_parts, copied_spans = copied_sections(code1, code2)
 
     return {
         "ast_similarity": round(ast_score, 2),
         "token_similarity": round(token_score, 2),
         "final_similarity": avg_score,
         "copied_sections" : copied_parts,
+        "copied_spans": copied_spans,
     }
 
+def copied_sections(code1, code2):
+    """Copied text of code1 and, at the same index, its spans in both files."""
+    lines1, lines2 = _line_starts(code1), _line_starts(code2)
+    copied_parts = []
+    copied_spans = []
+    with METRICS.timer('stage_seconds', stage='copy_regions'):
+        regions = distinct_regions(find_copied_regions(code1, code2))
+    for i, j, size in regions:
+        part = code1[i:i+size]
+        if not part.strip():
+            continue
+        copied_parts.append(part)
+        copied_spans.append({
+            "code1": _span(lines1, i, size),
+            "code2": _span(lines2, j, size),
+            "length": size,
+        })
+    return copied_parts, copied_spans
+
 @app.route('/')
 def check_active():
-    return jsonify({"status":"active"}), 200
+    # "active" means the service is up; "model" says whether /detect is ready
+    return jsonify({
+        "status": "active",
+        "model": model_state["status"],
+        "model_error": model_state["error"],
+        "model_revision": model_state["revision"],
+        "model_weights": model_state["weights"],
+        "inference_backend": INFERENCE_BACKEND,
+        "inference_worker": dict(inference_worker.stats)
+    }), 200
 
 @app.route('/compare', methods=['POST'])
 def compare_files():
     if 'file1' not in request.files or 'file2' not in request.files:
         return jsonify({"error": "Both files are required"}), 400
 
-    file1 = request.files['file1'].read().decode('utf-8')
-    file2 = request.files['file2'].read().decode('utf-8')
+    upload1, upload2 = request.files['file1'], request.files['file2']
+    file1 = upload1.read().decode('utf-8')
+    file2 = upload2.read().decode('utf-8')
 
-    result = combined_similarity(file1, file2)
+    result = combined_similarity(file1, file2, language_for(upload1.filename),
+                                 language_for(upload2.filename))
     return jsonify(result)
+
+# One-vs-many comparison: the query is parsed once, candidates are scored in
+# COMPARE_WORKERS processes, COMPARE_CHUNK at a time, and only the best
+# COMPARE_SECTIONS hits get copied sections. One chunk or less is scored in
+# the request thread. The process pool is started by the first request that
+# needs it and shared by later ones
+COMPARE_TOP_K = 10
+COMPARE_SECTIONS = 3
+COMPARE_WORKERS = int(os.environ.get('COMPARE_WORKERS', os.cpu_count() or 1))
+COMPARE_CHUNK = 32
+# Submissions of the plagiarism service, used with folder=uploads
+COMPARE_FOLDER = os.environ.get('COMPARE_FOLDER', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'uploads', 'assignments'))
+
+CompareFeatures = namedtuple('CompareFeatures', ['ast_nodes', 'tokens'])
+
+def compare_features(code, language=None):
+    return CompareFeatures(get_ast_node_types(code, language), token_ids(code, language))
+
+def similarity_scores(query, candidate):
+    """(AST, token) similarity of two CompareFeatures, as in combined_similarity."""
+    ast_score = SequenceMatcher(None, query.ast_nodes, candidate.ast_nodes).ratio() * 100
+    token_score = SequenceMatcher(None, query.tokens, candidate.tokens).ratio() * 100
+    return ast_score, token_score
+
+_compare_pool = None
+_compare_pool_lock = threading.Lock()
+
+def _get_compare_pool():
+    global _compare_pool
+    with _compare_pool_lock:
+        if _compare_pool is None:
+            # Spawned, not forked from this threaded process holding the model
+            _compare_pool = ProcessPoolExecutor(max_workers=COMPARE_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return _compare_pool
+
+def _discard_compare_pool(pool):
+    # A worker died; the next request starts a new pool
+    global _compare_pool
+    with _compare_pool_lock:
+        if _compare_pool is pool:
+            _compare_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _score_candidates(query, candidates):
+    return [(n,) + similarity_scores(query, compare_features(code, language_for(name)))
+            for n, name, code in candidates]
+
+def rank_candidates(query_code, candidates, k=COMPARE_TOP_K, sections=COMPARE_SECTIONS,
+                    query_name=None, workers=None):
+    """Score (name, code) candidates against query_code; return the top k,
+    best first, with copied sections for the first sections of them.
+    workers <= 1 scores them all in the calling thread."""
+    workers = COMPARE_WORKERS if workers is None else workers
+    query = compare_features(query_code, language_for(query_name))
+    # Names need not be unique, so candidates are tracked by position
+    items = [(n, name, code) for n, (name, code) in enumerate(candidates)]
+    chunks = [items[n:n + COMPARE_CHUNK] for n in range(0, len(items), COMPARE_CHUNK)]
+    if workers <= 1 or len(chunks) <= 1:
+        scores = _score_candidates(query, items)
+    else:
+        pool = _get_compare_pool()
+        try:
+            scores = [row for rows in pool.map(_score_candidates, [query] * len(chunks), chunks)
+                      for row in rows]
+        except BrokenProcessPool:
+            _discard_compare_pool(pool)
+            raise
+
+    ranked = sorted(((round((ast_score + token_score) / 2, 2), n, ast_score, token_score)
+                     for n, ast_score, token_score in scores),
+                    key=lambda row: (-row[0], row[1]))
+    results = []
+    for rank, (final, n, ast_score, token_score) in enumerate(ranked[:k], 1):
+        name, code = candidates[n]
+        result = {
+            "rank": rank,
+            "name": name,
+            "ast_similarity": round(ast_score, 2),
+            "token_similarity": round(token_score, 2),
+            "final_similarity": final,
+        }
+        if rank <= sections:
+            result["copied_sections"], result["copied_spans"] = copied_sections(query_code, code)
+        results.append(result)
+    return results
+
+def _folder_candidates(folder, skip_name=None):
+    # The files the plagiarism service's catalog compares, not only ALLOWED_EXTENSIONS
+    candidates = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if name == skip_name or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if is_submission(name, data):
+            candidates.append((name, data.decode('utf-8')))
+    return candidates
+
+@app.route('/compare/batch', methods=['POST'])
+def compare_batch():
+    """Compare one "query" file with many "candidates" files, or with every
+    submission when folder=uploads (the query's own file name is skipped).
+    k bounds the ranked results; sections says how many of the best get
+    copied sections."""
+    query_file = request.files.get('query')
+    if query_file is None or not query_file.filename:
+        return jsonify({"error": "A query file is required"}), 400
+    try:
+        k = int(request.values.get('k', COMPARE_TOP_K))
+        sections = int(request.values.get('sections', COMPARE_SECTIONS))
+    except ValueError:
+        return jsonify({"error": "k and sections must be integers"}), 400
+    if k < 1:
+        return jsonify({"error": "k must be at least 1"}), 400
+
+    query_name = secure_filename(query_file.filename) or query_file.filename
+    query_code = _decode_source(query_file.read())
+    folder = request.values.get('folder')
+    if folder:
+        if folder != 'uploads':
+            return jsonify({"error": "folder must be 'uploads'"}), 400
+        if not os.path.isdir(COMPARE_FOLDER):
+            return jsonify({"error": "The uploads folder does not exist"}), 404
+        candidates = _folder_candidates(COMPARE_FOLDER, skip_name=query_name)
+    else:
+        candidates = [(secure_filename(f.filename) or f.filename, _decode_source(f.read()))
+                      for f in request.files.getlist('candidates') if f.filename]
+    if not candidates:
+        return jsonify({"error": "No candidate files to compare with"}), 400
+
+    return jsonify({
+        "query": query_name,
+        "candidates": len(candidates),
+        "results": rank_candidates(query_code, candidates, k, sections, query_name),
+    })
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'py', 'java', 'js', 'cpp', 'c', 'go', 'rs'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -84,87 +337,212 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Model configuration
 MODEL_NAME = "Salesforce/codet5p-770m"
+# A branch or tag is resolved to a commit when the model loads; detection
+# results are cached under that commit (see weights_id). Pin one with MODEL_REVISION
+MODEL_REVISION = os.environ.get('MODEL_REVISION', 'main')
 AI_THRESHOLD = 0.5  # Use probability comparison instead of hard threshold
 
-# Initialize model
-try:
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForSequenceClassification.from_pretrained("Salesforce/codet5p-770m")
+# Inference backend: "torch" (fp32, GPU when available), "torch-int8" (dynamic
+# int8 quantization of the Linear layers, CPU only) or "onnx" (ONNX Runtime
+# through optimum). TORCH_THREADS > 0 pins torch's intra-op thread count.
+INFERENCE_BACKENDS = ('torch', 'torch-int8', 'onnx')
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
+TORCH_THREADS = int(os.environ.get('TORCH_THREADS', '0'))
+
+# Load the model on a background thread at startup; with MODEL_WARMUP=0 it
+# is loaded by the first request that needs it
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', '1') == '1'
+
+# The one shared tokenizer and pipeline, set by load_model()
+tokenizer = None
+detector = None
+model_state = {"status": "not_loaded", "error": None, "revision": None, "weights": None}
+_model_lock = threading.Lock()
+
+# missing_keys are the weights the checkpoint lacks, which from_pretrained
+# initialises randomly (e.g. a classification head added to a base model)
+BaseModel = namedtuple('BaseModel', ['tokenizer', 'model', 'missing_keys'])
+
+def load_base_model():
+    """Load the fp32 BaseModel every backend is built from."""
+    # Imported here so the service, and /compare, start without them
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+    if TORCH_THREADS > 0:
+        torch.set_num_threads(TORCH_THREADS)
+
+    loaded_tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+    model, info = AutoModelForSequenceClassification.from_pretrained(
+        MODEL_NAME, revision=MODEL_REVISION, output_loading_info=True)
+    model.eval()
+    return BaseModel(loaded_tokenizer, model, tuple(info['missing_keys']))
+
+def weights_id(base):
+    """The checkpoint commit of a BaseModel, plus a digest of the weights
+    initialised at load; two loads share an id only if they score alike."""
+    revision = getattr(base.model.config, '_commit_hash', None) or MODEL_REVISION
+    if not base.missing_keys:
+        return revision
+    state = base.model.state_dict()
+    digest = hashlib.sha256()
+    for name in sorted(base.missing_keys):
+        if name in state:
+            digest.update(name.encode('utf-8'))
+            digest.update(state[name].detach().cpu().float().numpy().tobytes())
+    return f"{revision}+{digest.hexdigest()[:16]}"
+
+def build_detector(backend='torch', base=None):
+    """Build a (tokenizer, text-classification pipeline) pair for a backend.
+
+    base is a BaseModel from load_base_model(); every
+    backend built from the same base scores the same weights. The base
+    model is not modified, except that "torch" moves it to the GPU.
+    """
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    import torch
+    from transformers import pipeline
+
+    loaded_tokenizer, model, _ = base or load_base_model()
+    if backend == 'onnx':
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        # Export the loaded weights rather than downloading them again
+        with tempfile.TemporaryDirectory() as export_dir:
+            model.save_pretrained(export_dir)
+            loaded_tokenizer.save_pretrained(export_dir)
+            ort_model = ORTModelForSequenceClassification.from_pretrained(export_dir, export=True)
+        return loaded_tokenizer, pipeline("text-classification", model=ort_model, tokenizer=loaded_tokenizer)
+
+    if backend == 'torch-int8':
+        model = torch.quantization.quantize_dynamic(copy.deepcopy(model).to('cpu'), {torch.nn.Linear},
+                                                    dtype=torch.qint8)
+        return loaded_tokenizer, pipeline("text-classification", model=model, tokenizer=loaded_tokenizer, device=-1)
+
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     model.to(device)
-    detector = pipeline("text-classification", model=model, tokenizer=tokenizer, device=0 if torch.cuda.is_available() else -1)
-except Exception as e:
-    print(f"Model loading failed: {str(e)}")
-    raise SystemExit("Failed to initialize model")
+    return loaded_tokenizer, pipeline("text-classification", model=model, tokenizer=loaded_tokenizer, device=0 if torch.cuda.is_available() else -1)
+
+def load_model():
+    """Load the tokenizer and detector pipeline once; later calls are no-ops."""
+    global tokenizer, detector
+    with _model_lock:
+        if detector is not None or model_state["status"] == "error":
+            return
+        model_state["status"] = "loading"
+        try:
+            base = load_base_model()
+            # Before build_detector, which may move or quantize the model
+            model_state["weights"] = weights_id(base)
+            model_state["revision"] = model_state["weights"].split('+')[0]
+            tokenizer, detector = build_detector(INFERENCE_BACKEND, base=base)
+            model_state["status"] = "ready"
+        except Exception as e:
+            print(f"Model loading failed: {str(e)}")
+            model_state["status"] = "error"
+            model_state["error"] = str(e)
+
+def get_detector():
+    if detector is None:
+        load_model()
+    if detector is None:
+        raise RuntimeError(f"Model unavailable: {model_state['error']}")
+    return detector
+
+def get_tokenizer():
+    get_detector()
+    return tokenizer
+
+# Only the serving process warms up; pool workers re-import this module
+if MODEL_WARMUP and multiprocessing.current_process().name == 'MainProcess':
+    threading.Thread(target=load_model, name='model-warmup', daemon=True).start()
+
+# Request threads do not call the pipeline themselves: one inference thread
+# owns it and merges queued work into micro-batches of up to
+# INFERENCE_BATCH_SIZE texts, waiting at most INFERENCE_MAX_WAIT_MS for a
+# batch to fill. Run one process with several threads (e.g. gunicorn
+# --workers 1 --threads 8) so a single copy of the model serves them all.
+INFERENCE_BATCH_SIZE = int(os.environ.get('INFERENCE_BATCH_SIZE', '32'))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', '10'))
+
+class InferenceWorker:
+    """Single owner of the detector pipeline, fed through a request queue."""
+
+    def __init__(self, batch_size=INFERENCE_BATCH_SIZE, max_wait_ms=INFERENCE_MAX_WAIT_MS):
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.stats = {"requests": 0, "batches": 0, "texts": 0}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, texts):
+        """Queue texts for scoring; the Future resolves to their pipeline outputs."""
+        future = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='inference-worker', daemon=True)
+                self._thread.start()
+        self._queue.put((list(texts), future))
+        return future
+
+    def _next_batch(self):
+        # Block for the first request, then gather more until full or timed out
+        items = [self._queue.get()]
+        size = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            items.append(item)
+            size += len(item[0])
+        return [(texts, future) for texts, future in items if future.set_running_or_notify_cancel()]
+
+    def _run(self):
+        while True:
+            items = self._next_batch()
+            texts = [text for item_texts, _ in items for text in item_texts]
+            try:
+                with METRICS.timer('stage_seconds', stage='forward'):
+                    outputs = get_detector()(texts, batch_size=self.batch_size,
+                                             truncation=True, max_length=512) if texts else []
+                METRICS.observe('inference_batch_texts', len(texts))
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            self.stats["requests"] += len(items)
+            self.stats["batches"] += 1
+            self.stats["texts"] += len(texts)
+            start = 0
+            for item_texts, future in items:
+                future.set_result(outputs[start:start + len(item_texts)])
+                start += len(item_texts)
+
+inference_worker = InferenceWorker()
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def preprocess_code(code):
+def preprocess_code(code, language=None):
     """Clean code before detection"""
     if not code:
         return ""
-    
-    # Remove comments
-    code = re.sub(r'#.*?\n', '\n', code)  # Python
-    code = re.sub(r'\/\/.*?\n', '\n', code)  # Java/C++
-    code = re.sub(r'\/\*.*?\*\/', '', code, flags=re.DOTALL)  # Multi-line
-    
+
+    # Remove comments; the lexer leaves '#' and '//' inside strings alone
+    code = strip_comments(code, language)
+
     # Normalize formatting
     code = '\n'.join([line.strip() for line in code.split('\n') if line.strip()])
     return code
 
-def detect_ai_code(code):
-    """Detect AI-generated code with confidence scores"""
-    if not code.strip():
-        return {
-            "ai_prob": 0.0,
-            "human_prob": 0.0,
-            "is_ai_generated": False,
-            "error": "Empty code content"
-        }
-    
-    try:
-        clean_code = preprocess_code(code)
-        if not clean_code.strip():
-            return {
-                "ai_prob": 0.0,
-                "human_prob": 0.0,
-                "is_ai_generated": False,
-                "error": "No code content after preprocessing"
-            }
-
-        result = detector(clean_code, truncation=True, max_length=512)[0]
-
-        # Dynamically infer label assignment
-        label = result['label']
-        score = result['score']
-        if label in ['LABEL_1', 'AI', 'generated']:
-            human_prob = 1-score
-            ai_prob = score
-        else:
-            human_prob =score
-            ai_prob = 1-score
-
-        # Decision based on higher probability
-        is_ai = ai_prob >= human_prob
-
-        return {
-            "ai_prob": round(ai_prob, 4),
-            "human_prob": round(human_prob, 4),
-            "is_ai_generated": is_ai,
-            "error": None
-        }
-    except Exception as e:
-        print(f"Detection error: {str(e)}")
-        return {
-            "ai_prob": 0.0,
-            "human_prob": 0.0,
-            "is_ai_generated": False,
-            "error": str(e)
-        }
-
 @app.route('/detect', methods=['POST'])
 def detect_code():
     # Initialize variables
@@ -211,14 +589,19 @@ def detect_code():
         if not data or 'code' not in data:
             return jsonify({'error': 'No code provided in JSON'}), 400
         code = data['code']
+        # An optional file name tells the language, e.g. for comment removal
+        filename = data.get('filename') or filename
     else:
         return jsonify({'error': 'Unsupported content type'}), 400
 
     if error:
         return jsonify({'error': error}), 400
 
+    if model_state["status"] == "error":
+        return jsonify({'error': f"Model unavailable: {model_state['error']}"}), 503
+
     # Perform detection
-    detection = detect_ai_code(code)
+    detection = detect_ai_code(code, language=language_for(filename))
     if detection['error']:
         return jsonify({'error': detection['error']}), 500
 
@@ -235,41 +618,333 @@ def detect_code():
 
 app.config['MAX_CONTENT_LENGTH'] = 350 * 1024 * 1024  # 350MB limit
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-detector = pipeline("text-classification", model=model, tokenizer=tokenizer, device=0 if torch.cuda.is_available() else -1)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def preprocess_code(code):
-    code = re.sub(r'#.*?\n', '\n', code)
-    code = re.sub(r'\/\/.*?\n', '\n', code)
-    code = re.sub(r'\/\*.*?\*\/', '', code, flags=re.DOTALL)
-    return '\n'.join([line.strip() for line in code.split('\n') if line.strip()])
+def detect_ai_code(code, windowed=True, language=None):
+    return detect_ai_batch([code], windowed=windowed, languages=[language])[0]
+
+# Detection results keyed by cleaned-code hash and model; the SQLite tier is
+# only used when DETECTION_CACHE_DB is set
+DETECTION_CACHE_SIZE = 10000
+DETECTION_CACHE_DB = os.environ.get('DETECTION_CACHE_DB')
+
+_detection_cache = OrderedDict()
+_detection_cache_lock = threading.Lock()
+detection_cache_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+_cache_db_ready = False
+
+def _cache_key(clean_code, windowed):
+    # Keyed on the loaded weights (see weights_id), so neither a moved branch
+    # nor another load's random head serves old results
+    digest = hashlib.sha256(clean_code.encode('utf-8')).hexdigest()
+    return f"{MODEL_NAME}@{model_state['weights']}/{INFERENCE_BACKEND}:{int(windowed)}:{digest}"
+
+def _open_cache_db():
+    global _cache_db_ready
+    conn = sqlite3.connect(DETECTION_CACHE_DB, timeout=30)
+    if not _cache_db_ready:
+        with conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS detections (
+                key TEXT PRIMARY KEY, ai_prob REAL NOT NULL, tokens INTEGER NOT NULL)''')
+        _cache_db_ready = True
+    return conn
+
+def _remember(key, value):
+    _detection_cache[key] = value
+    _detection_cache.move_to_end(key)
+    while len(_detection_cache) > DETECTION_CACHE_SIZE:
+        _detection_cache.popitem(last=False)
+
+def cache_get(key):
+    """Return the cached (ai_prob, tokens) for key, or None."""
+    with _detection_cache_lock:
+        value = _detection_cache.get(key)
+        if value is not None:
+            _detection_cache.move_to_end(key)
+            detection_cache_stats["hits"] += 1
+            METRICS.inc('cache_lookups_total', result='hit')
+            return value
+    if DETECTION_CACHE_DB:
+        conn = _open_cache_db()
+        try:
+            row = conn.execute('SELECT ai_prob, tokens FROM detections WHERE key = ?',
+                               (key,)).fetchone()
+        finally:
+            conn.close()
+        if row is not None:
+            with _detection_cache_lock:
+                _remember(key, row)
+                detection_cache_stats["disk_hits"] += 1
+            METRICS.inc('cache_lookups_total', result='disk_hit')
+            return row
+    with _detection_cache_lock:
+        detection_cache_stats["misses"] += 1
+    METRICS.inc('cache_lookups_total', result='miss')
+    return None
+
+def cache_put(key, ai_prob, tokens):
+    with _detection_cache_lock:
+        _remember(key, (ai_prob, tokens))
+    if DETECTION_CACHE_DB:
+        conn = _open_cache_db()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO detections (key, ai_prob, tokens) VALUES (?, ?, ?)',
+                             (key, ai_prob, tokens))
+        finally:
+            conn.close()
 
-def detect_ai_code(code):
-    if not code.strip():
-        return {"ai_prob": 0.0, "human_prob": 0.0, "is_ai_generated": False, "error": "Empty code"}
+DETECT_BATCH_SIZE = 16
+# Long code is scored in overlapping windows of WINDOW_TOKENS tokens that
+# start WINDOW_STRIDE tokens apart, leaving room for the special tokens
+WINDOW_TOKENS = 510
+WINDOW_STRIDE = 384
 
-    try:
-        clean_code = preprocess_code(code)
+def _ai_probability(result):
+    if result['label'] in ['LABEL_1', 'AI', 'generated']:
+        return result['score']
+    return 1 - result['score']
+
+def _detection(ai_prob, tokens=0):
+    human_prob = 1 - ai_prob
+    return {
+        "ai_prob": round(ai_prob, 4),
+        "human_prob": round(human_prob, 4),
+        "is_ai_generated": ai_prob >= human_prob,
+        "tokens": tokens,
+        "error": None
+    }
+
+def split_windows(clean_code, model_tokenizer=None):
+    """Split cleaned code into (text, n_tokens) windows of at most WINDOW_TOKENS."""
+    model_tokenizer = model_tokenizer or get_tokenizer()
+    ids = model_tokenizer(clean_code, add_special_tokens=False)['input_ids']
+    if len(ids) <= WINDOW_TOKENS:
+        return [(clean_code, len(ids))]
+    starts = list(range(0, len(ids) - WINDOW_TOKENS + 1, WINDOW_STRIDE))
+    if starts[-1] + WINDOW_TOKENS < len(ids):
+        starts.append(len(ids) - WINDOW_TOKENS)
+    return [(model_tokenizer.decode(ids[s:s + WINDOW_TOKENS], skip_special_tokens=True), WINDOW_TOKENS)
+            for s in starts]
+
+def detect_ai_batch(codes, batch_size=DETECT_BATCH_SIZE, windowed=True, pipe=None,
+                    model_tokenizer=None, languages=None):
+    """Run AI detection over many sources with batched forward passes.
+
+    With windowed, each source is split into overlapping token windows and
+    its probability is the token-weighted mean over its windows; otherwise
+    only the first 512 tokens are scored. Windows from all sources are
+    sorted by length so each batch pads to similar lengths. Results are
+    returned in input order, with the number of tokens scored per source.
+    languages, parallel to codes, tells how to strip comments; None entries
+    (or no list) are guessed from the code.
+
+    pipe and model_tokenizer score with another pipeline and tokenizer than
+    the shared ones, bypassing the result cache; they are used to compare
+    inference backends without loading the service's model.
+    """
+    if pipe is None:
+        # Cache keys name the loaded weights
+        load_model()
+    use_cache = pipe is None and model_state["weights"] is not None
+    results = [None] * len(codes)
+    windows = []
+    keys = {}
+    pending = {}
+    languages = languages or [None] * len(codes)
+    for i, (code, language) in enumerate(zip(codes, languages)):
+        if not code.strip():
+            results[i] = {"ai_prob": 0.0, "human_prob": 0.0, "is_ai_generated": False, "error": "Empty code"}
+            continue
+        with METRICS.timer('stage_seconds', stage='preprocess'):
+            clean_code = preprocess_code(code, language)
         if not clean_code.strip():
-            return {"ai_prob": 0.0, "human_prob": 0.0, "is_ai_generated": False, "error": "No content after cleaning"}
-
-        result = detector(clean_code, truncation=True, max_length=512)[0]
-        label, score = result['label'], result['score']
-        if label in ['LABEL_1', 'AI', 'generated']:
-            ai_prob, human_prob = score, 1 - score
-        else:
-            ai_prob, human_prob = 1 - score, score
-
-        return {
-            "ai_prob": round(ai_prob, 4),
-            "human_prob": round(human_prob, 4),
-            "is_ai_generated": ai_prob >= human_prob,
-            "error": None
-        }
-    except Exception as e:
-        return {"ai_prob": 0.0, "human_prob": 0.0, "is_ai_generated": False, "error": str(e)}
+            results[i] = {"ai_prob": 0.0, "human_prob": 0.0, "is_ai_generated": False, "error": "No content after cleaning"}
+            continue
+
+        # Unchanged code reuses its earlier result; repeats are scored once
+        keys[i] = _cache_key(clean_code, windowed)
+        if keys[i] in pending:
+            continue
+        cached = cache_get(keys[i]) if use_cache else None
+        if cached is not None:
+            results[i] = _detection(*cached)
+            continue
+        pending[keys[i]] = i
+        try:
+            if windowed:
+                with METRICS.timer('stage_seconds', stage='tokenize'):
+                    windows.extend((i, text, n_tokens) for text, n_tokens in split_windows(clean_code, model_tokenizer))
+            else:
+                windows.append((i, clean_code, 1))
+        except Exception as e:
+            results[i] = {"ai_prob": 0.0, "human_prob": 0.0, "is_ai_generated": False, "error": str(e)}
+
+    METRICS.inc('windows_total', len(windows))
+    windows.sort(key=lambda window: len(window[1]))
+    batches = [windows[start:start + batch_size] for start in range(0, len(windows), batch_size)]
+    if pipe is None:
+        # Queued in length order, so the worker's micro-batches stay similar
+        # in length even when merged with other requests' windows
+        futures = [inference_worker.submit([text for _, text, _ in batch]) for batch in batches]
+    weighted = defaultdict(float)
+    tokens = defaultdict(int)
+    for n, batch in enumerate(batches):
+        try:
+            if pipe is None:
+                outputs = futures[n].result()
+            else:
+                # The pipeline pads each batch to its longest member
+                with METRICS.timer('stage_seconds', stage='forward'):
+                    outputs = pipe([text for _, text, _ in batch], batch_size=len(batch),
+                                   truncation=True, max_length=512)
+        except Exception as e:
+            for i, _, _ in batch:
+                results[i] = {"ai_prob": 0.0, "human_prob": 0.0, "is_ai_generated": False, "error": str(e)}
+            continue
+        for (i, _, n_tokens), output in zip(batch, outputs):
+            weight = max(n_tokens, 1)
+            weighted[i] += _ai_probability(output) * weight
+            tokens[i] += weight
+
+    for i in tokens:
+        if results[i] is None:
+            ai_prob = weighted[i] / tokens[i]
+            if use_cache:
+                cache_put(keys[i], ai_prob, tokens[i])
+            results[i] = _detection(ai_prob, tokens[i])
+    for i, key in keys.items():
+        if results[i] is None and key in pending:
+            results[i] = results[pending[key]]
+    return results
+
+@app.route('/detect/cache', methods=['GET'])
+def detection_cache_info():
+    with _detection_cache_lock:
+        stats = dict(detection_cache_stats)
+        stats["entries"] = len(_detection_cache)
+    stats["disk_tier"] = bool(DETECTION_CACHE_DB)
+    return jsonify(stats)
+
+# ZIP members are read straight from the upload into memory. The caps apply
+# to the bytes actually decompressed, not the sizes the archive declares, so
+# a zip bomb is cut off after at most ZIP_MAX_TOTAL_BYTES
+ZIP_MAX_ENTRY_BYTES = int(os.environ.get('ZIP_MAX_ENTRY_BYTES', 5 * 1024 * 1024))
+ZIP_MAX_TOTAL_BYTES = int(os.environ.get('ZIP_MAX_TOTAL_BYTES', 500 * 1024 * 1024))
+# Files are scored in chunks as they are decoded
+ZIP_CHUNK_FILES = 64
+
+class ZipLimitError(ValueError):
+    pass
+
+def _decode_source(data):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+def iter_zip_sources(zip_ref, skipped):
+    """Yield (filename, code) for each supported member of an open ZipFile.
+
+    Members larger than ZIP_MAX_ENTRY_BYTES are added to skipped; going over
+    ZIP_MAX_TOTAL_BYTES in total raises ZipLimitError.
+    """
+    total = 0
+    for info in zip_ref.infolist():
+        fname = os.path.basename(info.filename)
+        if info.is_dir() or not allowed_file(fname):
+            continue
+        if info.file_size > ZIP_MAX_ENTRY_BYTES:
+            skipped.append(fname)
+            continue
+        with zip_ref.open(info) as member:
+            data = member.read(ZIP_MAX_ENTRY_BYTES + 1)
+        if len(data) > ZIP_MAX_ENTRY_BYTES:
+            skipped.append(fname)
+            continue
+        total += len(data)
+        if total > ZIP_MAX_TOTAL_BYTES:
+            raise ZipLimitError(f"ZIP contents exceed {ZIP_MAX_TOTAL_BYTES} bytes uncompressed")
+        yield fname, _decode_source(data)
+
+STREAM_FORMATS = ('ndjson', 'sse')
+# Streamed ZIP uploads larger than this are spooled to disk
+ZIP_SPOOL_BYTES = 64 * 1024 * 1024
+
+def stream_records(records, fmt):
+    """Send records as newline-delimited JSON, or as Server-Sent Events
+    named after each record's type."""
+    def generate():
+        for record in records:
+            payload = app.json.dumps(record)
+            if fmt == 'sse':
+                yield f"event: {record['type']}\ndata: {payload}\n\n"
+            else:
+                yield payload + '\n'
+
+    mimetype = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+    return app.response_class(stream_with_context(generate()), mimetype=mimetype,
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def detect_zip_records(zip_file, batch_size=DETECT_BATCH_SIZE):
+    """Yield a "file" record per scored file as each chunk is scored, then a
+    "summary" record with the overall verdict, or an "error" record when no
+    file could be scored."""
+    skipped = []
+    files_analyzed = 0
+    weighted_ai = 0.0
+    total_tokens = 0
+    with zipfile.ZipFile(zip_file) as zip_ref:
+        sources = iter_zip_sources(zip_ref, skipped)
+        while True:
+            chunk = list(islice(sources, ZIP_CHUNK_FILES))
+            if not chunk:
+                break
+            results = detect_ai_batch([content for _, content in chunk], batch_size,
+                                      languages=[language_for(fname) for fname, _ in chunk])
+            for (fname, _), result in zip(chunk, results):
+                if result['error']:
+                    continue
+
+                weighted_ai += result["ai_prob"] * result["tokens"]
+                total_tokens += result["tokens"]
+                files_analyzed += 1
+                yield {
+                    "type": "file",
+                    "filename": fname,
+                    "ai_prob": result["ai_prob"],
+                    "human_prob": result["human_prob"],
+                    "is_ai_generated": result["is_ai_generated"]
+                }
+
+    if not files_analyzed:
+        yield {"type": "error", "error": "No valid code files found in ZIP"}
+        return
+
+    # The overall verdict weighs each file by the number of tokens scored
+    overall_result = _detection(weighted_ai / max(total_tokens, 1))
+    yield {
+        "type": "summary",
+        "files_analyzed": files_analyzed,
+        "skipped_files": skipped,
+        "detection_result": {
+            "ai_prob": overall_result["ai_prob"],
+            "human_prob": overall_result["human_prob"],
+            "is_ai_generated": overall_result["is_ai_generated"]
+        },
+        "verdict": "AI-generated code" if overall_result["is_ai_generated"] else "Human-written code",
+        "confidence": max(overall_result["ai_prob"], overall_result["human_prob"])
+    }
+
+def _zip_error(e):
+    if isinstance(e, ZipLimitError):
+        return str(e), 413
+    if isinstance(e, zipfile.BadZipFile):
+        return 'Invalid ZIP archive', 400
+    return f"Error processing ZIP file: {str(e)}", 500
 
 @app.route('/detect-zip', methods=['POST'])
 def detect_zip():
@@ -280,62 +955,45 @@ def detect_zip():
     if not file.filename.endswith('.zip'):
         return jsonify({'error': 'File must be a ZIP archive'}), 400
 
-    temp_dir = tempfile.mkdtemp()
-    try:
-        zip_path = os.path.join(temp_dir, secure_filename(file.filename))
-        file.save(zip_path)
-
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
-
-        code_results = []
-        total_code = ''
-        for root, _, files in os.walk(temp_dir):
-            for fname in files:
-                if allowed_file(fname):
-                    path = os.path.join(root, fname)
-                    try:
-                        with open(path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                    except UnicodeDecodeError:
-                        with open(path, 'r', encoding='latin-1') as f:
-                            content = f.read()
-
-                    result = detect_ai_code(content)
-                    if result['error']:
-                        continue
-
-                    total_code += '\n' + content
-                    code_results.append({
-                        "filename": fname,
-                        "ai_prob": result["ai_prob"],
-                        "human_prob": result["human_prob"],
-                        "is_ai_generated": result["is_ai_generated"]
-                    })
-
-        if not code_results:
-            return jsonify({'error': 'No valid code files found in ZIP'}), 400
-
-        overall_result = detect_ai_code(total_code)
-        if overall_result['error']:
-            return jsonify({'error': overall_result['error']}), 500
-
-        return jsonify({
-            "files_analyzed": len(code_results),
-            "file_results": code_results,
-            "detection_result": {
-                "ai_prob": overall_result["ai_prob"],
-                "human_prob": overall_result["human_prob"],
-                "is_ai_generated": overall_result["is_ai_generated"]
-            },
-            "verdict": "AI-generated code" if overall_result["is_ai_generated"] else "Human-written code",
-            "confidence": max(overall_result["ai_prob"], overall_result["human_prob"])
-        })
+    if model_state["status"] == "error":
+        return jsonify({'error': f"Model unavailable: {model_state['error']}"}), 503
+
+    batch_size = max(1, request.form.get('batch_size', DETECT_BATCH_SIZE, type=int))
+
+    # ?stream=ndjson or ?stream=sse sends each file's result as it is scored
+    fmt = request.args.get('stream') or request.form.get('stream')
+    if fmt:
+        if fmt not in STREAM_FORMATS:
+            return jsonify({'error': f"stream must be one of: {', '.join(STREAM_FORMATS)}"}), 400
 
+        # Flask closes uploaded files when the view returns, so the archive
+        # is first copied to a spool file owned by the stream
+        upload = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES)
+        file.save(upload)
+
+        def records():
+            try:
+                yield from detect_zip_records(upload, batch_size)
+            except Exception as e:
+                yield {"type": "error", "error": _zip_error(e)[0]}
+            finally:
+                upload.close()
+
+        return stream_records(records(), fmt)
+
+    try:
+        records = list(detect_zip_records(file.stream, batch_size))
     except Exception as e:
-        return jsonify({'error': f"Error processing ZIP file: {str(e)}"}), 500
-    finally:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        error, code = _zip_error(e)
+        return jsonify({'error': error}), code
+
+    summary = records.pop()
+    if summary["type"] == "error":
+        return jsonify({'error': summary["error"]}), 400
+
+    del summary["type"]
+    file_results = [{k: v for k, v in record.items() if k != "type"} for record in records]
+    return jsonify({"file_results": file_results, **summary})
 
 if __name__ == '__main__':
     app.run(debug=True,port=1234)
\ No newline at end of file
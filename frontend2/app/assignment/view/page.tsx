@@ -63,7 +63,16 @@ const TeacherDashboard = () => {
       const response = await fetch('http://localhost:4321/api/run', {
         method: 'POST',
       });
-      const data = await response.json();
+      const { job_id } = await response.json();
+
+      // The check runs in the background; poll until the job has finished
+      let data = null;
+      while (!data || data.status === 'queued' || data.status === 'running') {
+        if (data) await new Promise((resolve) => setTimeout(resolve, 1000));
+        const statusResponse = await fetch(`http://localhost:4321/api/run/${job_id}`);
+        data = await statusResponse.json();
+      }
+      if (data.status !== 'done') throw new Error(data.details || data.error);
       setCompareResults(data);
       setShowCompareResults(true);
     } catch (error) {